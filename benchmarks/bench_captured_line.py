@@ -0,0 +1,69 @@
+"""
+Memory and construction speed of `CapturedLine`, compared to a plain (dict based) dataclass.
+Both the way the json output of ruff makes them (typed values, shared filenames) and from text (`CapturedLine.parse`).
+
+    python benchmarks/bench_captured_line.py [amount]
+"""
+
+import sys
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, List
+
+from ruff2bitbucket.common import CapturedLine
+
+
+@dataclass
+class PlainCapturedLine:  # How CapturedLine used to look like
+    filename: str
+    line: int = 0
+    column: int = 0
+    description: str = ""
+
+    def __post_init__(self) -> None:
+        self.filename = self.filename.strip()
+        self.line = int(self.line)
+        self.column = int(self.column)
+        self.description = self.description.rstrip()
+
+
+filenames = [f"src/package/module_{idx}.py" for idx in range(300)]  # Shared, like `relative_path` does
+
+
+def build(make: Callable[..., object], amount: int) -> List[object]:
+    return [make(filenames[idx % 300], idx % 1_000, idx % 80, "F401 unused import") for idx in range(amount)]
+
+
+def build_from_text(make: Callable[..., object], amount: int) -> List[object]:
+    # Every finding gets its own strings, like it does when it comes out of a regular expression.
+    return [
+        make(f"src/package/module_{idx % 300}.py", str(idx % 1_000), str(idx % 80), "F401 unused import")
+        for idx in range(amount)
+    ]
+
+
+def measure(
+    name: str, builder: Callable[[Callable[..., object], int], List[object]], make: Callable[..., object], amount: int
+) -> None:
+    tracemalloc.start()
+    findings = builder(make, amount)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del findings
+
+    seconds = min(timeit.repeat(lambda: builder(make, amount), number=1, repeat=3))
+    sys.stdout.write(f"{name:<30} {memory / amount:8.1f} bytes/finding {amount / seconds:12,.0f} findings/s\n")
+
+
+def main() -> None:
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sys.stdout.write(f"{amount:,} findings\n")
+    measure("PlainCapturedLine", build, PlainCapturedLine, amount)
+    measure("CapturedLine", build, CapturedLine, amount)
+    measure("PlainCapturedLine (text)", build_from_text, PlainCapturedLine, amount)
+    measure("CapturedLine.parse (text)", build_from_text, CapturedLine.parse, amount)
+
+
+if __name__ == "__main__":
+    main()
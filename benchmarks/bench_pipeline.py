@@ -0,0 +1,240 @@
+"""
+Benchmarks the capture -> transform -> upload pipeline on synthetic ruff output.
+
+    python benchmarks/bench_pipeline.py [--sizes 1000 100000 1000000] [--save-baseline]
+
+Every stage is timed (best of `--repeat`) and its peak python memory is measured with tracemalloc.
+The results are compared against the baseline file of a previous run.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterator, List
+from unittest import mock
+
+from fake_bitbucket import FakeBitbucket
+
+import ruff2bitbucket.__main__ as pipeline
+import ruff2bitbucket.uploader as uploader
+from ruff2bitbucket.aggregation import FindingStatistics
+from ruff2bitbucket.arguments import get_arguments
+from ruff2bitbucket.bitbucket import get_repo_info
+from ruff2bitbucket.cache import get_result_cache
+from ruff2bitbucket.capturer import check_code_mistakes, check_formatting
+from ruff2bitbucket.credentials import get_credentials
+from ruff2bitbucket.git import get_current_git_commit_hash, get_current_repo_uri, get_remote_urls
+from ruff2bitbucket.payload import JsonStream, get_compression
+from ruff2bitbucket.severity import get_rule_table
+from ruff2bitbucket.spool import get_spool
+from ruff2bitbucket.transport import get_retry_policy, get_session
+
+here = os.path.dirname(os.path.abspath(__file__))
+rules = [("F401", "`os` imported but unused", True), ("E501", "Line too long (130 > 120)", False)]
+
+
+def ruff_check_output(amount: int) -> Iterator[str]:
+    """What `ruff check --output-format=json-lines` prints for `amount` violations."""
+    for idx in range(amount):
+        code, message, fixable = rules[idx % len(rules)]
+        row = idx % 2_000 + 1
+        yield (
+            json.dumps(
+                {
+                    "cell": None,
+                    "code": code,
+                    "end_location": {"column": 10, "row": row},
+                    "filename": os.path.join(os.getcwd(), f"src/package/module_{idx % 500}.py"),
+                    "fix": {"applicability": "safe", "edits": [], "message": None} if fixable else None,
+                    "location": {"column": 1, "row": row},
+                    "message": message,
+                    "noqa_row": row,
+                    "url": None,
+                }
+            )
+            + "\n"
+        )
+
+
+def ruff_format_output(amount: int) -> Iterator[str]:
+    for idx in range(amount // 100):  # A lot less files than findings
+        yield f"Would reformat: src/package/module_{idx}.py\n"
+
+
+def write_outputs(directory: str, amount: int) -> Dict[str, str]:
+    """Writes the synthetic output to disk once, so generating it isn't part of the measurements."""
+    outputs = {}
+    for command, lines in (("check", ruff_check_output(amount)), ("format", ruff_format_output(amount))):
+        outputs[command] = os.path.join(directory, f"{command}_{amount}.txt")
+        with open(outputs[command], "w", encoding="utf-8") as fp:
+            fp.writelines(lines)
+
+    return outputs
+
+
+def fake_stream(outputs: Dict[str, str]) -> Callable[..., Iterator[str]]:
+    def stream(*cmd: str) -> Iterator[str]:
+        with open(outputs[cmd[1]], encoding="utf-8") as fp:
+            yield from fp
+
+    return stream
+
+
+def clear_caches() -> None:
+    """Everything that is remembered for the arguments of a run, so every run of main() starts from scratch."""
+    for cached in (
+        get_arguments,
+        get_credentials,
+        get_session,
+        get_retry_policy,
+        get_repo_info,
+        get_result_cache,
+        get_spool,
+        get_rule_table,
+        get_compression,
+        get_current_git_commit_hash,
+        get_current_repo_uri,
+        get_remote_urls,
+    ):
+        cached.cache_clear()
+
+
+def bench_parse(outputs: Dict[str, str]) -> Callable[[], int]:
+    def run() -> int:
+        with mock.patch("ruff2bitbucket.capturer.stream", new=fake_stream(outputs)):
+            return sum(1 for _ in check_code_mistakes()) + sum(1 for _ in check_formatting())
+
+    return run
+
+
+def fake_upload(_upload_uri: str, report: object, **_: object) -> mock.Mock:
+    """Serializes the body, like sending it would, without the network."""
+    for _ in report if isinstance(report, JsonStream) else [json.dumps(report)]:
+        pass
+    return mock.Mock(status_code=200)
+
+
+def bench_payloads(outputs: Dict[str, str]) -> Callable[[], int]:
+    with mock.patch("ruff2bitbucket.capturer.stream", new=fake_stream(outputs)):
+        captured_lines = list(check_code_mistakes())
+
+    def run() -> int:
+        statistics = FindingStatistics()
+        for captured_line in captured_lines:
+            statistics.add(captured_line)
+
+        with mock.patch.object(uploader, "bitbucket_upload", new=fake_upload):
+            uploader.upload_code_statistics("http://localhost/report", statistics)
+            asyncio.run(uploader.upload_code_insights("http://localhost/report/annotations", captured_lines))
+        return len(captured_lines)
+
+    return run
+
+
+def bench_main(outputs: Dict[str, str], amount: int, server: FakeBitbucket) -> Callable[[], int]:
+    def run() -> int:
+        clear_caches()
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(os.environ, {"BENCH_USER": "user", "BENCH_PASSWORD": "pass"}))
+            stack.enter_context(mock.patch("ruff2bitbucket.capturer.stream", new=fake_stream(outputs)))
+            stack.enter_context(mock.patch("shutil.which", return_value="ruff"))
+            stack.enter_context(
+                mock.patch(
+                    "ruff2bitbucket.bitbucket.get_current_repo_uri", return_value=f"{server.url}/scm/bench/repo.git"
+                )
+            )
+            stack.enter_context(
+                mock.patch("ruff2bitbucket.bitbucket.get_current_git_commit_hash", return_value="0" * 40)
+            )
+            pipeline.main()
+        clear_caches()
+        return amount + amount // 100
+
+    return run
+
+
+def measure(name: str, run: Callable[[], int], repeat: int) -> Dict[str, float]:
+    seconds = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        items = run()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {"seconds": seconds, "items_per_second": items / seconds, "peak_mb": peak / 1024 / 1024}
+    sys.stdout.write(
+        f"{name:<24} {seconds:9.3f} s {result['items_per_second']:14,.0f} items/s {result['peak_mb']:10.1f} MB"
+    )
+    return result
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> List[str]:
+    """Writes the difference with the baseline. Returns the benchmarks that became more than 10% slower."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        change = (result["seconds"] - baseline[name]["seconds"]) / baseline[name]["seconds"] * 100
+        sys.stdout.write(f"{name:<24} {change:+8.1f}% time {result['peak_mb'] - baseline[name]['peak_mb']:+10.1f} MB\n")
+        if change > 10:
+            regressions.append(name)
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=os.path.join(here, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+    sys.argv[1:] = []  # ruff2bitbucket parses the command line as well
+
+    results = {}
+    with FakeBitbucket() as server, tempfile.TemporaryDirectory() as directory:
+        for amount in args.sizes:
+            outputs = write_outputs(directory, amount)
+            for stage, bench in (
+                ("parse", bench_parse(outputs)),
+                ("payloads", bench_payloads(outputs)),
+                ("main", bench_main(outputs, amount, server)),
+            ):
+                name = f"{stage}[{amount}]"
+                results[name] = measure(name, bench, args.repeat)
+                sys.stdout.write("\n")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, indent=2)
+        sys.stdout.write(f"Baseline written to {args.baseline}\n")
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.stdout.write("No baseline to compare with (use --save-baseline).\n")
+        return
+
+    with open(args.baseline, encoding="utf-8") as fp:
+        regressions = compare(results, json.load(fp))
+
+    if regressions:
+        sys.stdout.write(f"Slower than the baseline: {', '.join(regressions)}\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+How long importing ruff2bitbucket takes, measured with `python -X importtime` in fresh processes.
+
+    python benchmarks/bench_startup.py [--repeat 20] [--save-baseline]
+
+Starting up happens on every run, also on the ones that find nothing to upload, so the heavy modules (the HTTP stack,
+asyncio, sqlite, the profiler) may only be imported by the stage that uses them. The benchmark fails when one of them
+is imported at startup, or when the import became more than 10% slower than the baseline.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+here = os.path.dirname(os.path.abspath(__file__))
+module = "ruff2bitbucket.__main__"
+lazy_modules = ("requests", "urllib3", "asyncio", "sqlite3", "importlib.metadata", "pstats", "cProfile")
+
+
+def import_once() -> Tuple[int, List[str]]:
+    """The microseconds it took to import `module`, and the modules that were imported for it."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imported: List[str] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == "site" and not name.startswith("  "):  # Everything before is python itself starting up
+            imported.clear()
+            continue
+        imported.append(name.strip())
+        if name.strip() == module:
+            return int(cumulative), imported
+
+    raise RuntimeError(f"No import time found for {module}:\n{result.stderr}")
+
+
+def measure(repeat: int) -> Tuple[Dict[str, float], List[str]]:
+    timings = []
+    imported: List[str] = []
+    for _ in range(repeat):
+        microseconds, imported = import_once()
+        timings.append(microseconds / 1_000)
+
+    result = {"best_ms": min(timings), "median_ms": statistics.median(timings), "modules": len(imported)}
+    sys.stdout.write(
+        f"import {module:<24} {result['best_ms']:8.1f} ms best {result['median_ms']:8.1f} ms median"
+        f" {result['modules']:6d} modules\n"
+    )
+    return result, imported
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", default=os.path.join(here, "startup_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    result, imported = measure(args.repeat)
+    eager = sorted(set(imported) & set(lazy_modules))
+    if eager:
+        sys.stdout.write(f"Imported at startup, but should only be imported when needed: {', '.join(eager)}\n")
+        sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, indent=2)
+        sys.stdout.write(f"Baseline written to {args.baseline}\n")
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.stdout.write("No baseline to compare with (use --save-baseline).\n")
+        return
+
+    with open(args.baseline, encoding="utf-8") as fp:
+        baseline = json.load(fp)
+
+    change = (result["best_ms"] - baseline["best_ms"]) / baseline["best_ms"] * 100
+    sys.stdout.write(f"{change:+.1f}% time, {result['modules'] - baseline['modules']:+d} modules\n")
+    if change > 10:
+        sys.stdout.write("Slower than the baseline.\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""A local stand-in for BitBucket: accepts every call and keeps track of what it received."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+class FakeBitbucketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real one
+
+    def _read_body(self) -> int:
+        """Reads the request body, which is chunked when it is streamed. Returns its size."""
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            length = int(self.headers.get("Content-Length") or 0)
+            return len(self.rfile.read(length)) if length else 0
+
+        received = 0
+        while length := int(self.rfile.readline().split(b";")[0], 16):
+            received += len(self.rfile.read(length))
+            self.rfile.readline()  # The CRLF after the chunk
+        while self.rfile.readline() not in (b"\r\n", b"\n", b""):  # The trailers
+            pass
+        return received
+
+    def _answer(self) -> None:
+        received = self._read_body()
+
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += received
+
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _answer  # noqa: N815
+
+    def log_message(self, *args: Any) -> None:  # noqa: ANN401
+        """Be quiet."""
+
+
+class FakeBitbucket(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FakeBitbucketHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_received = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> "FakeBitbucket":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.shutdown()
+        self.server_close()
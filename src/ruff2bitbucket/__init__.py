@@ -1,10 +1,16 @@
-try:
-    import importlib.metadata as importlib_metadata
-except ModuleNotFoundError:  # pragma: no cover
-    import importlib_metadata
+__all__ = ["__version__", "main"]
 
-from .__main__ import main
 
-__all__ = ["__version__", "main"]
+def __getattr__(name: str) -> object:
+    """`main` and `__version__` are only imported when they're used: the package itself starts fast."""
+    if name == "main":
+        from .__main__ import main
+
+        return main
+
+    if name == "__version__":
+        import importlib.metadata
+
+        return importlib.metadata.version(__name__)
 
-__version__ = importlib_metadata.version(__name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,97 +1,207 @@
-import json
 import logging
 import sys
-from itertools import chain
-from typing import List
-
-import requests
-
-from .bitbucket import get_repo_info
-from .capturer import check_code_mistakes, check_formatting
-from .common import CapturedLine
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, List
+
+from . import instrumentation
+from .aggregation import FindingStatistics, most_important
+from .arguments import get_arguments
+from .bitbucket import RepoInfo, get_repo_info
+from .cache import get_result_cache
+from .capturer import (
+    capture_concurrently,
+    check_code_mistakes,
+    check_formatting,
+    check_sharded,
+    check_with_cache,
+    only_changed_lines,
+)
+from .common import CapturedLine, in_directory
 from .credentials import get_credentials
+from .git import checkout, get_changed_files, get_changed_lines
+from .instrumentation import counted, in_current_stage, stage
+from .spool import get_spool
 
 __all__ = ["main"]
 
 logger = logging.getLogger(__name__)
 
 
-def bitbucket_upload(upload_uri: str, report: dict, name: str, error_code: int) -> None:
-    for credential in get_credentials():
-        response = requests.put(upload_uri, json=report, auth=credential.as_tuple())
-        if response.status_code == 401:  # Unauthorized
-            continue
+def capture_findings() -> Iterable[CapturedLine]:
+    args = get_arguments()
 
-        get_credentials().report_correct_combination(credential)
+    paths = ["."]
+    if args.diff_base:
+        with stage("git"):
+            paths = get_changed_files(args.diff_base)
 
-        if response.status_code == error_code:
-            logger.warning("'PUT %s' reported one or more errors:", upload_uri)
-            text = json.dumps(response.json(), indent=4).splitlines()
-            for line in text:
-                logger.warning("%s", line)
-        break  # But my authentication user was right, so we will stop here
-    else:
-        logger.error("Cannot upload the %s to bitbucket. No valid user/pass found.", name)
-        sys.exit(1)
+    check_code, check_format = check_code_mistakes, check_formatting
+    if args.shards:
+        check_code = partial(check_sharded, check_code_mistakes, args.shards)
+        check_format = partial(check_sharded, check_formatting, args.shards)
 
+    checks = [partial(check_code, paths), partial(check_format, paths)]
 
-def upload_code_insights(upload_uri: str, captured_lines: List[CapturedLine]) -> None:
-    annotations = []
-    for message in captured_lines[:1_000]:  # Bitbucket can receive at most 1000 annotations
-        annotations.append(
-            {
-                "reportKey": "ruff2bitbucket",
-                "path": message.filename,
-                "line": message.line,
-                "message": message.description,
-                "severity": "LOW",
-                "type": "CODE_SMELL",
-            }
-        )
+    cache = get_result_cache()
+    if cache is not None:
+        checks = [
+            partial(check_with_cache, check_code, "check", paths, cache),
+            partial(check_with_cache, check_format, "format", paths, cache),
+        ]
 
-    bitbucket_upload(upload_uri, report={"annotations": annotations}, name="annotations", error_code=404)
+    captured_lines = capture_concurrently(counted("ruff check", checks[0]), counted("ruff format", checks[1]))
 
+    if args.diff_base and args.only_changed_lines:
+        with stage("git"):
+            changed_lines = get_changed_lines(args.diff_base)
+        captured_lines = only_changed_lines(captured_lines, changed_lines)
 
-def upload_code_statistics(upload_uri: str, captured_lines: List[CapturedLine]) -> None:
-    need_reformat = sum(1 for cl in captured_lines if "reformat" in cl.description)
+    return captured_lines
 
-    report = {
-        "result": "FAIL" if captured_lines else "PASS",
-        "title": "ruff report",
-        "reporter": "ruff2bitbucket",
-        "report_type": "CODE_SMELL",
-        "data": [
-            {
-                "title": "Need reformat",
-                "type": "NUMBER",
-                "value": need_reformat,
-            },
-            {
-                "title": "Issue count",
-                "type": "NUMBER",
-                "value": len(captured_lines) - need_reformat,
-            },
-        ],
-    }
 
-    bitbucket_upload(upload_uri, report=report, name="report", error_code=400)
+def send(repo_info: RepoInfo, statistics: FindingStatistics, captured_lines: List[CapturedLine]) -> None:
+    """Uploads to BitBucket. The HTTP stack is imported here, so runs that upload nothing don't pay for it."""
+    import asyncio
 
+    from .uploader import upload
 
-def main() -> None:
-    logging.basicConfig()
+    asyncio.run(upload(repo_info, statistics, captured_lines))
 
-    creds = get_credentials()
-    if not creds:
-        logger.error("No valid credentials found.")
-        sys.exit(1)
 
-    captured_lines = list(chain(check_code_mistakes(), check_formatting()))
+def upload_findings() -> None:
+    """Checks the code in the current directory, and uploads the findings for its commit (or spools them)."""
+    max_annotations = get_arguments().max_annotations
+    statistics = FindingStatistics()
+    with stage("capture"):
+        findings = statistics.collect(capture_findings())
+        captured_lines = most_important(findings, max_annotations) if max_annotations else list(findings)
 
-    if not captured_lines:
+    if not statistics.findings:
         logger.info("no errors detected. No report will be uploaded.")
         sys.exit(0)
 
-    upload_code_statistics(get_repo_info().report_endpoint, captured_lines)
-    upload_code_insights(get_repo_info().annotations_endpoint, captured_lines)
+    if len(captured_lines) < statistics.findings:
+        logger.info(
+            "Only the %d most severe of the %d findings are annotated.", len(captured_lines), statistics.findings
+        )
+
+    with stage("git"):
+        repo_info = get_repo_info()
+
+    spool = get_spool()
+    if spool is not None:
+        with stage("spool"):
+            path = spool.put(repo_info, statistics, captured_lines)
+        logger.info("findings were spooled to %s", path)
+        return
+
+    send(repo_info, statistics, captured_lines)
+
+    logger.info("reports were succesfully uploaded:\n%s", repo_info.commit_url)
+
+
+def upload_target(target: str) -> bool:
+    """Handles one repository (or commit) of a batch. The credentials and HTTP connections are shared by all of them."""
+    try:
+        with checkout(target) as directory, in_directory(directory):
+            upload_findings()
+    except SystemExit as ex:  # Which is how a single run stops
+        return not ex.code
+    except Exception:
+        logger.exception("Checking '%s' failed.", target)
+        return False
+    return True
+
+
+def upload_spooled(path: str) -> bool:
+    """Uploads the findings of one commit that were spooled earlier. They are removed from the spool once uploaded."""
+    spool = get_spool()
+    try:
+        repo_info, statistics, captured_lines = spool.load(path)
+        send(repo_info, statistics, captured_lines)
+    except SystemExit as ex:
+        return not ex.code
+    except Exception:
+        logger.exception("Uploading '%s' failed.", path)
+        return False
+
+    spool.remove(path)
+    logger.info("reports were succesfully uploaded:\n%s", repo_info.commit_url)
+    return True
+
+
+def run_concurrently(func: Callable[[str], bool], items: List[str]) -> List[str]:
+    """Runs `func` for all the items on --batch-workers threads. Returns the items it failed for."""
+    with ThreadPoolExecutor(max_workers=get_arguments().batch_workers, thread_name_prefix="ruff2bitbucket") as pool:
+        succeeded = list(pool.map(in_current_stage(func), items))
+
+    return [item for item, success in zip(items, succeeded) if not success]
+
+
+def batch_targets(args: Namespace) -> List[str]:
+    targets = list(args.batch or [])
+    if args.batch_file:
+        with open(args.batch_file, encoding="utf-8") as fp:
+            targets.extend(line.strip() for line in fp if line.strip() and not line.lstrip().startswith("#"))
+    return targets
+
+
+def run_batch(targets: List[str]) -> None:
+    if failed := run_concurrently(upload_target, targets):
+        logger.error("Cannot upload %d of the %d targets: %s", len(failed), len(targets), ", ".join(failed))
+        sys.exit(1)
+
+
+def run_flush() -> None:
+    entries = get_spool().entries()
+    if not entries:
+        logger.info("The spool is empty, nothing to upload.")
+        return
+
+    if failed := run_concurrently(upload_spooled, entries):
+        logger.error("Cannot upload %d of the %d spooled commits; they stay in the spool.", len(failed), len(entries))
+        sys.exit(1)
+
+
+def run() -> None:
+    args = get_arguments()
+
+    if args.flush or not args.spool_dir:  # Spooling itself doesn't talk to BitBucket
+        with stage("credentials"):
+            creds = get_credentials()
+            if not creds:
+                logger.error("No valid credentials found.")
+                sys.exit(1)
+
+    if args.daemon:
+        from .daemon import serve
+
+        serve(args.daemon, upload_target)
+    elif args.flush:
+        run_flush()
+    elif targets := batch_targets(args):
+        run_batch(targets)
+    else:
+        upload_findings()
+
+
+def main() -> None:
+    logging.basicConfig()
 
-    logger.info("reports were succesfully uploaded:\n%s", get_repo_info().commit_url)
+    args = get_arguments()
+    instrumentation.reset()
+    if args.profile:
+        instrumentation.enable_profiling()
+
+    try:
+        with stage("total"):
+            run()
+    finally:
+        if args.timings:
+            sys.stderr.write(instrumentation.summary() + "\n")
+        if args.trace:
+            instrumentation.write_trace(args.trace)
+        if args.profile:
+            instrumentation.dump_profile(args.profile)
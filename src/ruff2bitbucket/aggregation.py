@@ -0,0 +1,75 @@
+import heapq
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Iterable, Iterator, List, Tuple
+
+from .bitbucket import annotation_severity
+from .common import CapturedLine
+from .severity import get_rule_table, severities, types
+
+__all__ = ["FindingStatistics", "is_reformat", "most_important"]
+
+
+def is_reformat(captured_line: CapturedLine) -> bool:
+    return not captured_line.code and "reformat" in captured_line.description
+
+
+@dataclass
+class FindingStatistics:
+    """Counts the findings while they stream by, without holding on to them."""
+
+    findings: int = 0
+    need_reformat: int = 0
+    per_rule: Counter = field(default_factory=Counter)
+    per_file: Counter = field(default_factory=Counter)
+    per_severity: Counter = field(default_factory=Counter)
+
+    @property
+    def issues(self) -> int:
+        return self.findings - self.need_reformat
+
+    def add(self, captured_line: CapturedLine) -> None:
+        self.findings += 1
+        self.per_file[captured_line.filename] += 1
+        self.per_severity[annotation_severity(captured_line)] += 1
+
+        if is_reformat(captured_line):
+            self.need_reformat += 1
+        else:
+            self.per_rule[captured_line.code or "other"] += 1
+
+    @classmethod
+    def restore(cls, state: dict) -> "FindingStatistics":
+        """The counterpart of `vars(statistics)`."""
+        return cls(**{name: Counter(value) if isinstance(value, dict) else value for name, value in state.items()})
+
+    def collect(self, captured_lines: Iterable[CapturedLine]) -> Iterator[CapturedLine]:
+        """Passes the findings on, counting them on the way."""
+        for captured_line in captured_lines:
+            self.add(captured_line)
+            yield captured_line
+
+
+def importance(captured_line: CapturedLine) -> Tuple[int, int]:
+    severity, type_ = get_rule_table().classify(captured_line)
+    return severities.index(severity), types.index(type_)
+
+
+def most_important(captured_lines: Iterable[CapturedLine], amount: int) -> List[CapturedLine]:
+    """
+    The `amount` most severe findings, in the order they came in. Equally severe findings that came first win.
+    Only `amount` findings are held on to at any time: O(n log amount) time and O(amount) memory.
+    """
+    if amount <= 0:
+        return []
+
+    heap: List[Tuple[Tuple[int, int], int, CapturedLine]] = []  # The least important one kept is on top
+    for index, captured_line in zip(count(), captured_lines):
+        entry = (importance(captured_line), -index, captured_line)
+        if len(heap) < amount:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:  # The indexes are unique, so the findings themselves are never compared
+            heapq.heapreplace(heap, entry)
+
+    return [captured_line for _, _, captured_line in sorted(heap, key=lambda entry: -entry[1])]
@@ -0,0 +1,177 @@
+import os
+from argparse import ArgumentParser, Namespace
+from functools import lru_cache
+
+__all__ = ["get_arguments"]
+
+
+def _cache_file(name: str) -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "ruff2bitbucket", name)
+
+
+@lru_cache(1)
+def get_arguments() -> Namespace:
+    parser = ArgumentParser()
+
+    parser.add_argument("--user", help="Username (or username env var) for authentication", default=None, nargs="?")
+
+    group = parser.add_mutually_exclusive_group(required=False)
+    group.add_argument("--pass", help="Password used for authentication", default=None, dest="pass_")
+    group.add_argument("--token", help="BitBucket API token used for authentication", default=None)
+    group.add_argument("--service_name", help="Service name for keyring authentication", default=None)
+    group.add_argument("--passvar", help="Environment variable for password", default=None)
+
+    parser.add_argument(
+        "--diff-base",
+        help="Only check the files changed since HEAD branched off from this branch/commit (e.g. origin/master)",
+        default=None,
+    )
+    parser.add_argument(
+        "--only-changed-lines",
+        help="Together with --diff-base: only report findings on the changed lines",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--result-cache",
+        help="Database remembering the findings of files that didn't change",
+        default=None,
+        nargs="?",
+        const=_cache_file("results.sqlite"),
+    )
+    parser.add_argument(
+        "--result-cache-size", help="Maximum number of files kept in the result cache", default=100_000, type=int
+    )
+
+    parser.add_argument(
+        "--credential-cache",
+        help="File remembering which user/pass worked the last time (only a fingerprint is stored)",
+        default=None,
+        nargs="?",
+        const=_cache_file("credential.json"),
+    )
+    parser.add_argument(
+        "--credential-cache-ttl", help="Seconds the credential cache stays valid", default=86_400.0, type=float
+    )
+
+    parser.add_argument(
+        "--shards",
+        help="Split the files over this many ruff runs at the same time (default: the number of CPUs)",
+        default=None,
+        nargs="?",
+        const=os.cpu_count() or 1,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--remote",
+        help="The git remote that points to BitBucket (default: origin, or else the first one)",
+        default=None,
+    )
+    parser.add_argument(
+        "--bitbucket-url",
+        help="Where BitBucket is, when it can't be derived from the remote (like with ssh: https://host:port/context)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--connect-timeout", help="Seconds to wait for a connection to BitBucket", default=10.0, type=float
+    )
+    parser.add_argument("--read-timeout", help="Seconds to wait for BitBucket to answer", default=60.0, type=float)
+    parser.add_argument("--pool-size", help="Max connections kept open to BitBucket", default=10, type=int)
+    parser.add_argument(
+        "--annotation-batch-size", help="Annotations sent to BitBucket per call", default=1_000, type=int
+    )
+    parser.add_argument(
+        "--max-annotations",
+        help="Only annotate this many findings, the most severe ones (0: all of them)",
+        default=1_000,
+        type=int,
+    )
+    parser.add_argument(
+        "--severity",
+        help="Severity (LOW/MEDIUM/HIGH) and type (BUG/CODE_SMELL/VULNERABILITY) of a rule, like S=HIGH:VULNERABILITY",
+        action="append",
+        metavar="RULE=SEVERITY[:TYPE]",
+    )
+    parser.add_argument(
+        "--max-message-bytes",
+        help="Annotation messages are cut to this many bytes (utf-8), BitBucket refuses longer ones (0: no limit)",
+        default=2_000,
+        type=int,
+    )
+    parser.add_argument(
+        "--compress", help="Send the annotations gzipped, if BitBucket accepts that", action="store_true"
+    )
+    parser.add_argument(
+        "--reconcile",
+        help="Only send what changed since the last upload for this commit (for re-runs on the same commit)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--upload-concurrency", help="Annotation batches uploaded at the same time", default=4, type=int
+    )
+    parser.add_argument("--retries", help="Retries for a call BitBucket didn't answer properly", default=3, type=int)
+    parser.add_argument(
+        "--retry-backoff", help="Seconds to wait before the first retry, doubled every time", default=0.5, type=float
+    )
+    parser.add_argument("--retry-max-wait", help="Max seconds to wait before a retry", default=30.0, type=float)
+    parser.add_argument(
+        "--retry-budget",
+        help="Max retries shared by all the calls to the same endpoint in one upload",
+        default=10,
+        type=int,
+    )
+    parser.add_argument(
+        "--circuit-breaker",
+        help="Stop calling BitBucket after this many failures in a row",
+        default=5,
+        type=int,
+    )
+
+    parser.add_argument(
+        "--batch",
+        help="Repositories (paths) or commits (of the current repository) to check and upload, all in one go",
+        nargs="+",
+        default=None,
+        metavar="TARGET",
+    )
+    parser.add_argument("--batch-file", help="File with one --batch target per line", default=None)
+    parser.add_argument(
+        "--batch-workers",
+        help="Targets of a batch (or jobs of the daemon) handled at the same time",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--daemon",
+        help="Keep running, and check the repositories scripts/ruff2bitbucket sends over this unix socket",
+        default=None,
+        metavar="SOCKET",
+    )
+
+    parser.add_argument(
+        "--spool-dir", help="Store the findings in this directory, to be uploaded later with --flush", default=None
+    )
+    parser.add_argument(
+        "--flush", help="Upload everything that was stored in --spool-dir (nothing is checked)", action="store_true"
+    )
+
+    parser.add_argument("--timings", help="Print how long every stage took", action="store_true")
+    parser.add_argument("--trace", help="Write the timings of every stage as json to this file", default=None)
+    parser.add_argument("--profile", help="Write a cProfile dump of the python code to this file", default=None)
+
+    args = parser.parse_args()
+    from .severity import RuleTable, default_rules, parse_rules  # It needs the arguments itself
+
+    try:  # Before ruff runs, instead of once the first finding is classified
+        RuleTable({**default_rules, **parse_rules(args.severity or [])})
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if args.flush and not args.spool_dir:
+        parser.error("--flush needs --spool-dir")
+    if args.daemon and (args.flush or args.batch or args.batch_file):
+        parser.error("--daemon gets its jobs from the socket, not from --flush or --batch")
+    return args
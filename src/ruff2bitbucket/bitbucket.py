@@ -2,45 +2,151 @@
 https://developer.atlassian.com/server/bitbucket/rest/v815/api-group-builds-and-deployments/#api-insights-latest-projects-projectkey-repos-repositoryslug-commits-commitid-reports-key-annotations-post
 """
 
+import contextlib
 import re
+import subprocess
+from dataclasses import dataclass, field
 from functools import lru_cache
+from typing import List, Optional
 from urllib.parse import urlparse
 
-from .git import get_current_git_commit_hash, get_current_repo_uri
+from .arguments import get_arguments
+from .common import CapturedLine, per_directory
+from .git import get_current_git_commit_hash, get_current_repo_uri, get_remote_urls
+from .severity import get_rule_table
 
-__all__ = ["get_repo_info"]
+__all__ = ["Remote", "annotation_severity", "annotation_type", "get_repo_info", "parse_remote"]
+
+
+def annotation_severity(captured_line: CapturedLine) -> str:
+    """One of LOW, MEDIUM or HIGH."""
+    return get_rule_table().classify(captured_line)[0]
+
+
+def annotation_type(captured_line: CapturedLine) -> str:
+    """One of BUG, CODE_SMELL or VULNERABILITY."""
+    return get_rule_table().classify(captured_line)[1]
+
+
+@dataclass(frozen=True)
+class Remote:
+    base_url: str  # Where BitBucket itself is, like "https://host:port/context"
+    key: str  # The project key, or "~user" for a personal repository
+    slug: str
+    guessed: bool = field(default=False, compare=False)  # ssh: any git host looks like this, not only BitBucket
+
+
+remote_patterns = (
+    # Cloning over http(s): https://host:port/context/scm/key/slug.git, personal ones have ~user as key
+    re.compile(r"^(?P<base>https?://[^/]+(?:/.*?)?)/scm/(?P<key>[^/]+)/(?P<slug>[^/]+?)(?:\.git)?/?$", re.IGNORECASE),
+    # The url of the repository in the browser: https://host:port/context/projects/KEY/repos/slug/browse
+    re.compile(
+        r"^(?P<base>https?://[^/]+(?:/.*?)?)/(?:projects/(?P<key>[^/]+)|users/(?P<user>[^/]+))/repos/(?P<slug>[^/.]+)"
+        r"(?:[/.].*)?$",
+        re.IGNORECASE,
+    ),
+    # ssh://git@host:7999/key/slug.git
+    re.compile(
+        r"^ssh://(?:[^@/]+@)?(?P<host>[^:/]+)(?::\d+)?/(?P<key>[^/]+)/(?P<slug>[^/]+?)(?:\.git)?/?$", re.IGNORECASE
+    ),
+    # The scp like syntax: git@host:key/slug.git
+    re.compile(r"^(?:[^@/]+@)?(?P<host>[^:/]+):(?P<key>[^/]+)/(?P<slug>[^/]+?)(?:\.git)?$", re.IGNORECASE),
+)
+
+
+@lru_cache(maxsize=1_024)
+def parse_remote(url: str) -> Optional[Remote]:
+    """Where BitBucket is, and which repository `url` is. None when it doesn't look like a BitBucket url."""
+    for pattern in remote_patterns:
+        if match := pattern.match(url):
+            groups = match.groupdict()
+            key = groups["key"] or f"~{groups['user']}"
+            if groups.get("host"):  # ssh: assume the web interface is on the same host
+                base_url = f"https://{groups['host']}"
+            else:
+                parsed = urlparse(groups["base"])
+                base_url = f"{parsed.scheme}://{parsed.hostname}" + (f":{parsed.port}" if parsed.port else "")
+                base_url += parsed.path
+            return Remote(base_url=base_url, key=key, slug=groups["slug"], guessed=bool(groups.get("host")))
+
+    return None
+
+
+def _candidate_urls(remote: Optional[str]) -> List[str]:
+    """The url of the chosen remote. Otherwise the one of 'origin', followed by the other remotes."""
+    if remote:
+        if url := get_remote_urls().get(remote):
+            return [url]
+        raise ValueError(f"There is no remote called '{remote}'.")
+
+    origin = ""
+    with contextlib.suppress(subprocess.CalledProcessError):  # There might be no 'origin'
+        origin = get_current_repo_uri()
+
+    if (remote := parse_remote(origin)) and not remote.guessed:
+        return [origin]  # The common case: no need to look any further
+    return [origin, *get_remote_urls().values()]
+
+
+def _hostname(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+def _pick_remote(urls: List[str], bitbucket_url: Optional[str], chosen: bool) -> Optional[Remote]:
+    """
+    The http(s) urls say they are BitBucket, so they come first. An ssh url could be any git host (like GitHub), so it
+    is only used when BitBucket is known to be on that host: from `--bitbucket-url` or one of the http(s) urls.
+    """
+    remotes = [remote for remote in map(parse_remote, urls) if remote]
+    certain = [remote for remote in remotes if not remote.guessed]
+    bitbucket_hosts = {_hostname(remote.base_url) for remote in certain}
+    if bitbucket_url:
+        bitbucket_hosts.add(_hostname(bitbucket_url))
+
+    guessed = [
+        remote
+        for remote in remotes
+        if remote.guessed and (_hostname(remote.base_url) in bitbucket_hosts or (chosen and bitbucket_url))
+    ]
+    return next(iter(certain + guessed), None)
 
 
 class RepoInfo:
     def __init__(self) -> None:
-        url = get_current_repo_uri()
-        if not url:
-            raise ValueError("No git has been set up, so we can't upload anything to BitBucket.")
-
-        self.parse_result = urlparse(url)
+        args = get_arguments()
 
-        match = re.search(r"/scm/(?P<key>.*?)/(?P<slug>.*?)\.git", self.parse_result.path, re.IGNORECASE)
-        if not match:
-            match = re.search(
-                r"/projects/(?P<key>.*?)/repos/(?P<slug>.*?)[/\\.].*$",
-                self.parse_result.path,
-                re.IGNORECASE,
-            )
+        urls = [url for url in _candidate_urls(args.remote) if url]
+        if not urls:
+            raise ValueError("No git has been set up, so we can't upload anything to BitBucket.")
 
-        if not match:
+        remote = _pick_remote(urls, args.bitbucket_url, chosen=bool(args.remote))
+        if not remote:
+            hint = " Use --bitbucket-url to use an ssh remote." if any(map(parse_remote, urls)) else ""
             raise ValueError(
-                f"Couldn't interpret '{url}' as a BitBucket url. Please file an issue if this is in error!"
+                f"Couldn't interpret '{urls[0]}' as a BitBucket url.{hint} Please file an issue if this is in error!"
             )
 
-        self.repo_key = match.group(1)
-        self.repo_slug = match.group(2)
+        self.base_url = (args.bitbucket_url or remote.base_url).rstrip("/")
+        self.repo_key = remote.key
+        self.repo_slug = remote.slug
         self.commit_id = get_current_git_commit_hash()
 
+    @classmethod
+    def restore(cls, state: dict) -> "RepoInfo":
+        """The counterpart of `vars(repo_info)`: a RepoInfo of an earlier run, without looking at git."""
+        repo_info = cls.__new__(cls)
+        repo_info.__dict__.update(state)
+        return repo_info
+
+    @property
+    def repository_endpoint(self) -> str:
+        return f"{self.base_url}/rest/api/latest/projects/{self.repo_key}/repos/{self.repo_slug}"
+
     @property
     def report_endpoint(self) -> str:
         return (
-            f"{self.parse_result.scheme}://{self.parse_result.netloc}/rest/insights/latest/projects/{self.repo_key}"
-            f"/repos/{self.repo_slug}/commits/{self.commit_id}/reports/ruff2bitbucket"
+            f"{self.base_url}/rest/insights/latest/projects/{self.repo_key}/repos/{self.repo_slug}"
+            f"/commits/{self.commit_id}/reports/ruff2bitbucket"
         )
 
     @property
@@ -49,12 +155,10 @@ class RepoInfo:
 
     @property
     def commit_url(self) -> str:
-        return (
-            f"{self.parse_result.scheme}://{self.parse_result.netloc}/projects/{self.repo_key}"
-            f"/repos/{self.repo_slug}/commits/{self.commit_id}"
-        )
+        owner = f"users/{self.repo_key[1:]}" if self.repo_key.startswith("~") else f"projects/{self.repo_key}"
+        return f"{self.base_url}/{owner}/repos/{self.repo_slug}/commits/{self.commit_id}"
 
 
-@lru_cache(1)
+@per_directory
 def get_repo_info() -> RepoInfo:
     return RepoInfo()
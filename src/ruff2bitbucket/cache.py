@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from .arguments import get_arguments
+from .common import CapturedLine, batched
+
+__all__ = ["ResultCache", "get_result_cache"]
+
+
+class ResultCache:
+    """
+    Remembers the findings of ruff per file content, so unchanged files don't need to be checked again.
+    The least recently used entries are dropped once there are more than `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: int) -> None:
+        import sqlite3  # Only imported when the cache is used
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.max_entries = max_entries
+        self._lock = threading.Lock()  # The checks run in their own threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, findings TEXT NOT NULL, last_used REAL)"
+            )
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[CapturedLine]]:
+        found = {}
+        now = time.time()
+
+        with self._lock, self._connection:
+            for batch in batched(keys, 500):  # Stay below the maximum amount of sqlite parameters
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, findings FROM results WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                self._connection.execute(
+                    f"UPDATE results SET last_used = ? WHERE key IN ({placeholders})",
+                    [now, *batch],
+                )
+                for key, findings in rows:
+                    found[key] = [CapturedLine.parse(**finding) for finding in json.loads(findings)]
+
+        return found
+
+    def put_many(self, entries: Dict[str, List[CapturedLine]]) -> None:
+        now = time.time()
+        rows = [(key, json.dumps([asdict(finding) for finding in findings]), now) for key, findings in entries.items()]
+
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", rows)
+            self._connection.execute(
+                "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+@lru_cache(1)
+def get_result_cache() -> Optional[ResultCache]:
+    args = get_arguments()
+    if not args.result_cache:
+        return None
+
+    return ResultCache(args.result_cache, args.result_cache_size)
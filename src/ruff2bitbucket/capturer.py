@@ -1,16 +1,36 @@
 import contextlib
+import contextvars
+import hashlib
+import json
 import logging
+import os
+import queue
 import re
 import shutil
-from typing import Iterable
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from .common import CapturedLine, run
+from .cache import ResultCache
+from .common import CapturedLine, batched, current_directory, run, stream
+from .git import get_file_hashes, python_suffixes
 
-__all__ = ["check_code_mistakes", "check_formatting"]
+__all__ = [
+    "capture_concurrently",
+    "check_code_mistakes",
+    "check_formatting",
+    "check_sharded",
+    "check_with_cache",
+    "only_changed_lines",
+    "split_in_shards",
+]
 
 
-capturer = re.compile(r"^(?P<filename>.*?):(?P<line>\d+):(?P<column>\d+):\s*(?P<description>.*)$", flags=re.IGNORECASE)
 formater = re.compile(r"^(?P<description>Would reformat):?\s*(?P<filename>.*?)$", flags=re.IGNORECASE)
+config_files = ("pyproject.toml", "ruff.toml", ".ruff.toml")
+section_header = re.compile(r"^\s*\[(?P<section>[^\[\]]+)\]")
+include_setting = re.compile(r"^\s*(?:extend-)?include\s*=")
 logger = logging.getLogger(__name__)
 
 
@@ -19,33 +39,282 @@ def has_executable(name: str) -> bool:
 
 
 def yield_from_regex(*cmd: str, regex_to_use: re.Pattern) -> Iterable[CapturedLine]:
-    output = run(*cmd, check=False)
-    for line in output.stdout.strip().splitlines():
+    for line in stream(*cmd):
         with contextlib.suppress(AttributeError):
-            yield CapturedLine(**regex_to_use.match(line).groupdict())
+            yield CapturedLine.parse(**regex_to_use.match(line).groupdict())
 
 
-def check_code_mistakes() -> Iterable[CapturedLine]:
+@lru_cache(maxsize=4_096)
+def relative_path(filename: str, cwd: str) -> str:
+    """ruff reports absolute paths. There are far less files than findings, so this is cached."""
+    return os.path.relpath(filename, cwd).replace(os.sep, "/")
+
+
+def parse_ruff_violation(violation: dict) -> CapturedLine:
+    """Converts one violation from ruff's json output into a CapturedLine."""
+
+    code = violation.get("code") or ""
+    fix = violation.get("fix") or {}
+    fixable = fix.get("applicability") == "safe"
+
+    # Mimic ruff's own 'concise' output: "F401 [*] `os` imported but unused"
+    description = " ".join(part for part in (code, "[*]" if fixable else "", violation["message"]) if part)
+
+    location = violation.get("location") or {}
+    end_location = violation.get("end_location") or {}
+
+    return CapturedLine(
+        filename=relative_path(violation["filename"], current_directory()),
+        line=location.get("row", 0),
+        column=location.get("column", 0),
+        description=description,
+        code=sys.intern(code),  # relative_path already shares the filenames
+        end_line=end_location.get("row", 0),
+        end_column=end_location.get("column", 0),
+        fixable=fixable,
+    )
+
+
+def yield_from_json_lines(*cmd: str) -> Iterable[CapturedLine]:
+    """Parses the output of a ruff command that was started with '--output-format=json-lines'."""
+    for line in stream(*cmd):
+        if not line.strip():
+            continue
+
+        try:
+            yield parse_ruff_violation(json.loads(line))
+        except (ValueError, KeyError):
+            logger.warning("Couldn't interpret ruff's output: %s", line.rstrip())
+
+
+def check_code_mistakes(paths: Sequence[str] = (".",)) -> Iterable[CapturedLine]:
     """
     Yields a list of detected errors in the files.
     Falls back to flake8 if ruff doesn't exist on the system (which it should, as it's a dependency of this package!).
     """
 
+    if not paths:
+        return
+
     if has_executable("ruff"):
-        yield from yield_from_regex("ruff", "check", "--no-fix", ".", regex_to_use=capturer)
+        yield from yield_from_json_lines(
+            "ruff", "check", "--no-fix", "--force-exclude", "--output-format=json-lines", *paths
+        )
     # elif has_executable("flake8"):
     #     yield from yield_from_regex("flake8", ".", regex_to_use=capturer)
     else:
         logger.warning("No code validation is done as ruff is not available.")
 
 
-def check_formatting() -> Iterable[CapturedLine]:
+def check_formatting(paths: Sequence[str] = (".",)) -> Iterable[CapturedLine]:
     """
     Yields a list of files that would be reformatted.
     Falls back to black if ruff isn't there.
     """
 
+    if not paths:
+        return
+
     if has_executable("ruff"):
-        yield from yield_from_regex("ruff", "format", "--check", ".", regex_to_use=formater)
+        yield from yield_from_regex("ruff", "format", "--check", "--force-exclude", *paths, regex_to_use=formater)
     else:
         logger.warning("No format check is done because ruff is not available.")
+
+
+@lru_cache(1)
+def get_ruff_version() -> str:
+    return run("ruff", "--version", check=True).stdout.strip()
+
+
+def ruff_config_paths(filenames: Iterable[str]) -> List[str]:
+    """Every ruff configuration file that could apply: the ones in this tree and in the parent directories."""
+    config_paths = sorted(filename for filename in filenames if os.path.basename(filename) in config_files)
+
+    root = directory = current_directory()
+    while directory != (parent := os.path.dirname(directory)):
+        directory = parent
+        config_paths.extend(os.path.relpath(os.path.join(directory, name), root) for name in config_files)
+
+    return config_paths
+
+
+def ruff_config_hash(filenames: Iterable[str]) -> str:
+    """Hash of every ruff configuration file that could apply."""
+    digest = hashlib.sha256()
+    for path in ruff_config_paths(filenames):
+        with contextlib.suppress(OSError), open(os.path.join(current_directory(), path), "rb") as fp:
+            digest.update(path.encode() + b"\0" + fp.read() + b"\0")
+
+    return digest.hexdigest()
+
+
+def widens_include(config_paths: Iterable[str]) -> bool:
+    """Whether a ruff configuration sets `include` or `extend-include`, so ruff checks more than the python files."""
+    for path in config_paths:
+        try:
+            with open(os.path.join(current_directory(), path), encoding="utf-8") as fp:
+                lines = fp.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            continue
+
+        wanted = "tool.ruff" if os.path.basename(path) == "pyproject.toml" else ""  # ruff.toml: the top level
+        section = ""
+        for line in lines:
+            if header := section_header.match(line):
+                section = header["section"].strip()
+            elif section == wanted and include_setting.match(line):
+                return True
+
+    return False
+
+
+def python_files(file_hashes: Dict[str, Optional[str]]) -> Optional[List[str]]:
+    """
+    The files ruff checks when it is given ".": the python files git knows about.
+    None when the configuration includes other files as well, as only ruff itself knows which ones then.
+    """
+    if widens_include(ruff_config_paths(file_hashes)):
+        logger.debug("The ruff configuration widens 'include', so ruff is given '.' itself.")
+        return None
+    return [filename for filename in file_hashes if filename.endswith(python_suffixes)]
+
+
+def check_with_cache(
+    check: Callable[[Sequence[str]], Iterable[CapturedLine]], name: str, paths: Sequence[str], cache: ResultCache
+) -> Iterator[CapturedLine]:
+    """
+    Only runs `check` on the files that aren't in the cache yet. The findings of the other files come from the cache.
+    A file is known by its path and git blob hash (the path matters for rules like per-file-ignores), together with
+    the ruff version and its configuration.
+    """
+
+    if not has_executable("ruff"):
+        yield from check(paths)  # Which will complain about it
+        return
+
+    file_hashes = get_file_hashes()
+    files = python_files(file_hashes) if list(paths) == ["."] else paths
+    if files is None:  # Can't tell which files the findings are for
+        yield from check(paths)
+        return
+
+    namespace = f"{name}:{get_ruff_version()}:{ruff_config_hash(file_hashes)}"
+    keys = {file: f"{namespace}:{file}:{file_hashes[file]}" for file in files if file_hashes.get(file)}
+
+    cached = cache.get_many(keys.values())
+    misses = []
+    for file in files:
+        if file in keys and keys[file] in cached:
+            yield from cached[keys[file]]
+        else:
+            misses.append(file)
+
+    # A cold cache is filled with one run over the original paths, otherwise only the misses are checked.
+    # These are passed in batches to keep the command line within reasonable limits.
+    fresh = {file: [] for file in misses if file in keys}
+    for batch in batched(misses, 1_000) if cached else [paths]:
+        for captured_line in check(batch):
+            if captured_line.filename in fresh:
+                fresh[captured_line.filename].append(captured_line)
+            yield captured_line
+
+    cache.put_many({keys[file]: findings for file, findings in fresh.items()})
+
+
+def only_changed_lines(
+    captured_lines: Iterable[CapturedLine], changed_lines: Dict[str, List[Tuple[int, int]]]
+) -> Iterator[CapturedLine]:
+    """Drops the findings outside the changed hunks. Findings about a whole file (line 0) are kept for changed files."""
+    for captured_line in captured_lines:
+        ranges = changed_lines.get(captured_line.filename)
+        if ranges is None:
+            continue
+
+        if captured_line.line == 0 or any(first <= captured_line.line <= last for first, last in ranges):
+            yield captured_line
+
+
+def capture_concurrently(*checks: Callable[[], Iterable[CapturedLine]]) -> Iterator[CapturedLine]:
+    """
+    Runs all the checks at the same time, each one in its own thread.
+    The results are yielded in the order the checks were given, so the outcome is the same as chaining them.
+    """
+
+    done = object()
+
+    def drain(check: Callable[[], Iterable[CapturedLine]], results: queue.SimpleQueue) -> None:
+        try:
+            for captured_line in check():
+                results.put(captured_line)
+        finally:
+            results.put(done)
+
+    with ThreadPoolExecutor(max_workers=max(len(checks), 1), thread_name_prefix="ruff2bitbucket") as pool:
+        pending = []
+        for check in checks:
+            results = queue.SimpleQueue()
+            # The checks see the same context (like the directory to run in) as the caller
+            pending.append((pool.submit(contextvars.copy_context().run, drain, check, results), results))
+
+        for future, results in pending:
+            while (captured_line := results.get()) is not done:
+                yield captured_line
+            future.result()  # Re-raises whatever went wrong inside the thread
+
+
+def _file_size(filename: str) -> int:
+    try:
+        return os.path.getsize(os.path.join(current_directory(), filename))
+    except OSError:
+        return 0
+
+
+def split_in_shards(files: Sequence[str], count: int) -> List[List[str]]:
+    """
+    Splits the files in at most `count` shards of about the same total size.
+    The shards are consecutive runs of the sorted files, so handling them one after the other keeps the order of files.
+    """
+    files = sorted(files)
+    sizes = [_file_size(file) for file in files]
+    remaining = sum(sizes)
+
+    shards: List[List[str]] = []
+    shard: List[str] = []
+    shard_size = 0
+    for file, size in zip(files, sizes):
+        shard.append(file)
+        shard_size += size
+        if len(shards) < count - 1 and shard_size >= remaining / (count - len(shards)):
+            shards.append(shard)
+            remaining -= shard_size
+            shard, shard_size = [], 0
+
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def check_sharded(
+    check: Callable[[Sequence[str]], Iterable[CapturedLine]], shards: int, paths: Sequence[str]
+) -> Iterator[CapturedLine]:
+    """
+    Runs `check` on `shards` parts of the files at the same time, each part in its own ruff process.
+    The findings come in the same order as when all files are checked in one run.
+    """
+    files = python_files(get_file_hashes()) if list(paths) == ["."] else paths
+
+    if shards <= 1 or files is None or len(files) <= 1 or not has_executable("ruff"):
+        yield from check(paths)
+        return
+
+    yield from capture_concurrently(
+        *(partial(_check_in_batches, check, shard) for shard in split_in_shards(files, shards))
+    )
+
+
+def _check_in_batches(
+    check: Callable[[Sequence[str]], Iterable[CapturedLine]], files: List[str]
+) -> Iterator[CapturedLine]:
+    """Runs `check` on at most 1000 files at a time, to keep the command line within reasonable limits."""
+    for batch in batched(files, 1_000):
+        yield from check(batch)
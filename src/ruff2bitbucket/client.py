@@ -0,0 +1,49 @@
+"""
+The thin client of `ruff2bitbucket --daemon`: hands the current directory to the daemon over its unix socket and shows
+what the daemon logs. Only a few standard modules are imported, so it starts fast. Without a daemon, everything runs
+in this process like it always did.
+"""
+
+import json
+import os
+import socket
+import sys
+from typing import Optional
+
+__all__ = ["main", "submit"]
+
+socket_variable = "RUFF2BITBUCKET_SOCKET"
+
+
+def submit(path: str, directory: str, commit: Optional[str] = None) -> Optional[int]:
+    """Runs a job on the daemon listening on `path`. Returns its exit code, or None when there is no daemon."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+
+    with connection, connection.makefile("r", encoding="utf-8") as answers:
+        connection.sendall((json.dumps({"directory": directory, "commit": commit}) + "\n").encode("utf-8"))
+        for answer in answers:
+            message = json.loads(answer)
+            if "log" in message:
+                sys.stderr.write(message["log"] + "\n")
+            if "exit" in message:
+                return message["exit"]
+
+    sys.stderr.write("Lost the connection to the ruff2bitbucket daemon.\n")
+    return 1
+
+
+def main() -> None:
+    path = os.environ.get(socket_variable)
+    if path and len(sys.argv) == 1:  # The daemon uses the options it was started with
+        exit_code = submit(path, os.getcwd())
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from . import main as run
+
+    run()
@@ -1,22 +1,122 @@
+import os
 import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass
+from functools import lru_cache, wraps
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, TypeVar, Union
 
-__all__ = ["CapturedLine", "run"]
+from .instrumentation import record
 
+__all__ = ["CapturedLine", "batched", "current_directory", "in_directory", "per_directory", "run", "stream"]
 
-@dataclass
+T = TypeVar("T")
+
+_directory: ContextVar[Optional[str]] = ContextVar("directory", default=None)
+
+
+def current_directory() -> str:
+    """The directory git and ruff are run in. That's the working directory, unless `in_directory` says otherwise."""
+    return _directory.get() or os.getcwd()
+
+
+@contextmanager
+def in_directory(path: str) -> Iterator[None]:
+    """Runs git and ruff in `path`, for this thread (or asyncio task) only. Used to handle several repositories."""
+    token = _directory.set(os.path.abspath(path))
+    try:
+        yield
+    finally:
+        _directory.reset(token)
+
+
+def per_directory(func: Callable[[], T]) -> Callable[[], T]:
+    """Like `lru_cache(1)`, but the result is remembered for every directory given to `in_directory`."""
+    cached = lru_cache(maxsize=None)(lambda directory: func())  # noqa: ARG005
+
+    @wraps(func)
+    def wrapper() -> T:
+        return cached(_directory.get())
+
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+@dataclass(slots=True)
 class CapturedLine:
+    """
+    One finding. There can be millions of these, sharing a few hundred filenames and rule codes.
+    So the class is slotted, and the filenames and codes are shared (see `parse`).
+    """
+
     filename: str
     line: int = 0
     column: int = 0
     description: str = ""
+    code: str = ""
+    end_line: int = 0
+    end_column: int = 0
+    fixable: bool = False
 
-    def __post_init__(self) -> None:
-        self.filename = self.filename.strip()
-        self.line = int(self.line)
-        self.column = int(self.column)
-        self.description = self.description.rstrip()
+    @classmethod
+    def parse(
+        cls,
+        filename: str,
+        line: Union[int, str] = 0,
+        column: Union[int, str] = 0,
+        description: str = "",
+        code: str = "",
+        end_line: Union[int, str] = 0,
+        end_column: Union[int, str] = 0,
+        fixable: bool = False,
+    ) -> "CapturedLine":
+        """
+        From text: the numbers can still be strings, and every finding has its own copy of the filename and code.
+        The constructor itself takes them as they are, as it's on the hot path of the json output of ruff.
+        """
+        return cls(
+            sys.intern(filename.strip()),
+            int(line),
+            int(column),
+            description.rstrip(),
+            sys.intern(code),
+            int(end_line),
+            int(end_column),
+            fixable,
+        )
 
 
 def run(*cmd: str, check: bool) -> subprocess.CompletedProcess:
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=check)
+    start = time.perf_counter()
+    try:
+        return subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=check, cwd=_directory.get()
+        )
+    finally:
+        record(subprocess_seconds=time.perf_counter() - start)
+
+
+def stream(*cmd: str) -> Iterator[str]:
+    """Yields the stdout of the command line by line, while the command is still running."""
+    start = time.perf_counter()
+    try:
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=_directory.get()
+        ) as process:
+            try:
+                yield from process.stdout
+            except GeneratorExit:  # Nobody is listening anymore, so don't wait for the command to finish
+                process.kill()
+                raise
+    finally:
+        record(subprocess_seconds=time.perf_counter() - start)
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Splits the iterable in lists of at most `size` items (`itertools.batched` is only there from python 3.12)."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import contextlib
+import hashlib
+import hmac
+import json
+import logging
 import os
+import time
 from abc import ABC, abstractmethod
-from argparse import ArgumentParser
+from argparse import Namespace
 from dataclasses import dataclass, field
 from functools import lru_cache
 from itertools import product
 from typing import ClassVar, Iterator, List, Tuple
 
-__all__ = ["UserPass", "get_credentials"]
+from .arguments import get_arguments
+
+__all__ = ["CredentialCache", "UserPass", "get_credentials"]
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass(frozen=True)
@@ -35,9 +44,61 @@ class UserPass:
         return self.username, self.password
 
 
+@dataclass
+class CredentialCache:
+    """
+    Remembers which user/pass worked the last time, so the next run can try that one first.
+    Only a salted fingerprint of the combination is written to disk, never the password itself.
+    """
+
+    path: str
+    ttl: float
+    iterations: ClassVar[int] = 100_000
+
+    def _fingerprint(self, combo: UserPass, salt: bytes) -> str:
+        return hashlib.pbkdf2_hmac("sha256", "\0".join(combo.as_tuple()).encode(), salt, self.iterations).hex()
+
+    def find(self, candidates: List[UserPass]) -> UserPass | None:
+        """Returns the candidate that worked the last time, if it didn't expire yet."""
+        try:
+            with open(self.path, encoding="utf-8") as fp:
+                content = json.load(fp)
+
+            if time.time() - content["timestamp"] > self.ttl:
+                return None
+
+            salt = bytes.fromhex(content["salt"])
+            fingerprint = content["fingerprint"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        return next(
+            (combo for combo in candidates if hmac.compare_digest(self._fingerprint(combo, salt), fingerprint)),
+            None,
+        )
+
+    def store(self, combo: UserPass) -> None:
+        salt = os.urandom(16)
+        content = {"salt": salt.hex(), "fingerprint": self._fingerprint(combo, salt), "timestamp": time.time()}
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with os.fdopen(
+                os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8"
+            ) as fp:
+                json.dump(content, fp)
+            os.replace(temp_path, self.path)
+        except OSError as ex:
+            logger.warning("Couldn't write the credential cache '%s': %s", self.path, ex)
+
+
 @dataclass
 class Credentials(ABC):
     _correct_combination: UserPass | None = field(default=None, init=False)
+    _cache: CredentialCache | None = field(default=None, init=False)
+    _cached_combination: UserPass | None = field(default=None, init=False)
+    _cache_searched: bool = field(default=False, init=False)
 
     @property
     @abstractmethod
@@ -52,14 +113,41 @@ class Credentials(ABC):
         return len(self._up)
 
     def __iter__(self) -> Iterator[UserPass]:
-        """Returns the user/pass to pass on to BitBucket."""
+        """Returns the user/pass to pass on to BitBucket. The one that worked the last time comes first."""
         if self._correct_combination:
             yield self._correct_combination
-        else:
-            yield from self._up
+            return
+
+        cached = self._find_cached()
+        if cached:
+            yield cached
+        yield from (combo for combo in self._up if combo != cached)
+
+    def _find_cached(self) -> UserPass | None:
+        """Looks in the cache only once: hashing the candidates is slow on purpose."""
+        if not self._cache_searched:
+            self._cached_combination = self._cache.find(self._up) if self._cache else None
+            self._cache_searched = True
+        return self._cached_combination
+
+    def cached_combination(self) -> UserPass | None:
+        """The user/pass that worked the last time, if it's still one of the candidates."""
+        if self._correct_combination:
+            return self._correct_combination
+
+        return self._find_cached()
+
+    def use_cache(self, cache: CredentialCache) -> None:
+        self._cache = cache
+        self._cache_searched = False
 
     def report_correct_combination(self, combo: UserPass) -> None:
+        if combo == self._correct_combination:
+            return
+
         self._correct_combination = combo
+        if self._cache and combo != self._find_cached():  # The cache has it already
+            self._cache.store(combo)
 
 
 @dataclass
@@ -143,18 +231,16 @@ class KeyringCredentials(Credentials):
 
 @lru_cache(1)
 def get_credentials() -> Credentials:
-    parser = ArgumentParser()
+    args = get_arguments()
 
-    parser.add_argument("--user", help="Username (or username env var) for authentication", default=None, nargs="?")
+    credentials = _credentials_from_arguments(args)
+    if args.credential_cache:
+        credentials.use_cache(CredentialCache(args.credential_cache, args.credential_cache_ttl))
 
-    group = parser.add_mutually_exclusive_group(required=False)
-    group.add_argument("--pass", help="Password used for authentication", default=None, dest="pass_")
-    group.add_argument("--token", help="BitBucket API token used for authentication", default=None)
-    group.add_argument("--service_name", help="Service name for keyring authentication", default=None)
-    group.add_argument("--passvar", help="Environment variable for password", default=None)
+    return credentials
 
-    args = parser.parse_args()
 
+def _credentials_from_arguments(args: Namespace) -> Credentials:
     if args.pass_:
         return UserPassCredentials(args.user, args.pass_)
     if args.token:
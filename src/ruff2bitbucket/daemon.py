@@ -0,0 +1,157 @@
+"""
+Keeps ruff2bitbucket running on a CI runner (`--daemon SOCKET`). The jobs come in over a unix socket and don't pay for
+starting python, the imports, finding the credentials and connecting to BitBucket: all of that is done once.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import BinaryIO, Callable, Optional
+
+from .arguments import get_arguments
+from .bitbucket import get_repo_info
+from .common import in_directory
+from .git import get_current_git_commit_hash, get_current_repo_uri, get_remote_urls
+
+__all__ = ["JobServer", "serve"]
+
+logger = logging.getLogger(__name__)
+
+
+class JobOutput:
+    """Sends json lines to the client of a job. The job logs from several threads, and the client can be gone."""
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self._stream = stream
+        self._lock = threading.Lock()
+        self._connected = True
+
+    def send(self, **message: object) -> None:
+        with self._lock:
+            if not self._connected:
+                return
+            try:
+                self._stream.write((json.dumps(message) + "\n").encode("utf-8"))
+                self._stream.flush()
+            except OSError:
+                self._connected = False
+
+
+_output: ContextVar[Optional[JobOutput]] = ContextVar("output", default=None)
+
+
+class JobLogHandler(logging.Handler):
+    """Passes what a job logs on to its client."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        output = _output.get()
+        if output is not None:
+            output.send(log=self.format(record))
+
+
+def forget_repositories() -> None:
+    """HEAD moves between jobs, so what was read from git before can't be trusted anymore."""
+    for cached in (get_current_git_commit_hash, get_current_repo_uri, get_remote_urls, get_repo_info):
+        cached.cache_clear()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """One job: a json line with the directory of the repository (and optionally a commit in it) to check."""
+
+    server: "JobServer"
+
+    def handle(self) -> None:
+        output = JobOutput(self.wfile)
+        try:
+            job = json.loads(self.rfile.readline())
+            directory, commit = job["directory"], job.get("commit")
+        except (ValueError, KeyError, TypeError):
+            output.send(log="Invalid job, expected a json line with a 'directory'.", exit=2)
+            return
+
+        if not os.path.isabs(directory) or not os.path.isdir(directory):
+            output.send(log=f"'{directory}' isn't a directory.", exit=2)
+            return
+
+        token = _output.set(output)
+        try:
+            forget_repositories()
+            with in_directory(directory):
+                succeeded = self.server.run_job(commit or directory)
+        finally:
+            _output.reset(token)
+        output.send(exit=0 if succeeded else 1)
+
+
+class JobServer(socketserver.UnixStreamServer):
+    """Accepts jobs on a unix socket and runs at most `workers` of them at the same time; the others wait their turn."""
+
+    def __init__(self, path: str, run_job: Callable[[str], bool], workers: int) -> None:
+        self.run_job = run_job
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ruff2bitbucket-job")
+        self._log_handler = JobLogHandler()
+        self._log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        logging.getLogger().addHandler(self._log_handler)
+        super().__init__(path, JobHandler)
+
+    def server_bind(self) -> None:
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)  # Jobs upload with our credentials: only for this user
+
+    def process_request(self, request: socket.socket, client_address: str) -> None:
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request: socket.socket, client_address: str) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.shutdown(wait=True)
+        logging.getLogger().removeHandler(self._log_handler)
+
+
+def _remove_stale_socket(path: str) -> None:
+    """A daemon that was killed leaves its socket behind. One that still answers is left alone."""
+    if not os.path.exists(path):
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return
+
+    raise ValueError(f"Another daemon is listening on '{path}' already.")
+
+
+def serve(path: str, run_job: Callable[[str], bool]) -> None:
+    """Runs the jobs that come in on `path` with `run_job` (which gets the directory or commit to check)."""
+    _remove_stale_socket(path)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # Stopping the runner removes the socket as well
+
+    server = JobServer(path, run_job, get_arguments().batch_workers)
+    logger.info("Waiting for jobs on %s", path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
@@ -1,15 +1,135 @@
-from functools import lru_cache
+import logging
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from .common import run
+from .common import current_directory, per_directory, run
+from .gitdir import Unsupported, find_git_directory
 
-__all__ = ["get_current_git_commit_hash", "get_current_repo_uri"]
+__all__ = [
+    "checkout",
+    "get_changed_files",
+    "get_changed_lines",
+    "get_current_git_commit_hash",
+    "get_current_repo_uri",
+    "get_file_hashes",
+    "get_remote_urls",
+    "python_suffixes",
+]
 
+python_suffixes = (".py", ".pyi", ".ipynb")  # What ruff looks at by default
+hunk_header = re.compile(r"^@@ -\d+(?:,\d+)? \+(?P<start>\d+)(?:,(?P<count>\d+))? @@")
+logger = logging.getLogger(__name__)
 
-@lru_cache(1)
+
+@per_directory
 def get_current_git_commit_hash() -> str:
+    try:
+        return find_git_directory(current_directory()).head()
+    except (Unsupported, OSError, ValueError) as ex:
+        logger.debug("Asking git for the commit: %s", ex)
+
     return run("git", "rev-parse", "HEAD", check=True).stdout.strip()
 
 
-@lru_cache(1)
+@per_directory
 def get_current_repo_uri() -> str:
+    try:
+        if url := find_git_directory(current_directory()).config("remote.origin.url"):
+            return url
+    except (Unsupported, OSError, ValueError) as ex:
+        logger.debug("Asking git for the remote: %s", ex)
+
     return run("git", "config", "--get", "remote.origin.url", check=True).stdout.strip()
+
+
+@per_directory
+def get_remote_urls() -> Dict[str, str]:
+    """The url of every remote, by name."""
+    try:
+        if urls := find_git_directory(current_directory()).remote_urls():
+            return urls
+    except (Unsupported, OSError, ValueError) as ex:
+        logger.debug("Asking git for the remotes: %s", ex)
+
+    urls = {}
+    for line in run("git", "config", "--get-regexp", r"^remote\..*\.url$", check=False).stdout.splitlines():
+        key, _, url = line.partition(" ")
+        if key.startswith("remote.") and key.endswith(".url"):
+            urls[key[len("remote.") : -len(".url")]] = url.strip()
+    return urls
+
+
+def _diff(base: str, *options: str) -> str:
+    """Diff between the merge base of `base` and HEAD, relative to the current directory."""
+    return run("git", "-c", "core.quotePath=off", "diff", "--relative", *options, f"{base}...HEAD", check=True).stdout
+
+
+def get_changed_files(base: str) -> List[str]:
+    """The python files that were added/changed since HEAD branched off from `base` (deleted files are left out)."""
+    return [
+        line for line in _diff(base, "--name-only", "--diff-filter=d").splitlines() if line.endswith(python_suffixes)
+    ]
+
+
+def get_changed_lines(base: str) -> Dict[str, List[Tuple[int, int]]]:
+    """Per changed file, the (first, last) line numbers of every hunk since HEAD branched off from `base`."""
+    changed_lines: Dict[str, List[Tuple[int, int]]] = {}
+
+    ranges = None
+    for line in _diff(base, "--unified=0", "--no-color", "--no-ext-diff").splitlines():
+        if line.startswith("+++ "):
+            filename = line[4:].rstrip("\t")  # git ends the name with a tab when it contains a space
+            ranges = None if filename == "/dev/null" else changed_lines.setdefault(filename.removeprefix("b/"), [])
+        elif ranges is not None and (match := hunk_header.match(line)):
+            start = int(match["start"])
+            count = 1 if match["count"] is None else int(match["count"])
+            if count:  # A count of 0 means lines were only removed
+                ranges.append((start, start + count - 1))
+
+    return changed_lines
+
+
+def get_file_hashes() -> Dict[str, Optional[str]]:
+    """
+    The git blob hash of every file in (and below) the current directory.
+    Files that are changed in the working tree or untracked have `None`, as their content isn't in git (yet).
+    """
+    file_hashes: Dict[str, Optional[str]] = {}
+
+    for line in run("git", "-c", "core.quotePath=off", "ls-files", "--stage", check=True).stdout.splitlines():
+        info, _, filename = line.partition("\t")
+        file_hashes[filename] = info.split()[1]
+
+    others = run(
+        "git", "-c", "core.quotePath=off", "ls-files", "--modified", "--others", "--exclude-standard", check=True
+    )
+    for filename in others.stdout.splitlines():
+        if os.path.exists(os.path.join(current_directory(), filename)):
+            file_hashes[filename] = None
+        else:  # Deleted from the working tree
+            file_hashes.pop(filename, None)
+
+    return file_hashes
+
+
+@contextmanager
+def checkout(target: str) -> Iterator[str]:
+    """
+    Yields the directory to check for `target`.
+    That's either a repository on disk, or a commit of the current repository which is checked out in a temporary
+    worktree for the duration.
+    """
+    if os.path.isdir(target):
+        yield target
+        return
+
+    import tempfile  # Takes long to import, and batches of commits are rare
+
+    with tempfile.TemporaryDirectory(prefix="ruff2bitbucket-", ignore_cleanup_errors=True) as directory:
+        run("git", "worktree", "add", "--detach", directory, target, check=True)
+        try:
+            yield directory
+        finally:
+            run("git", "worktree", "remove", "--force", directory, check=False)
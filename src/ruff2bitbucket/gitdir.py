@@ -0,0 +1,176 @@
+"""
+Reads the little git metadata that is needed (the commit of HEAD and the url of a remote) straight from the `.git`
+directory, which is a lot cheaper than starting `git`.
+Anything out of the ordinary raises `Unsupported`, so the caller can ask `git` itself instead.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+__all__ = ["GitDirectory", "Unsupported", "find_git_directory"]
+
+object_id = re.compile(r"^[0-9a-f]{40}(?:[0-9a-f]{24})?$")  # sha1 or sha256
+section_header = re.compile(r'^\[\s*(?P<section>[\w.-]+)(?:\s+"(?P<subsection>(?:[^"\\]|\\.)*)")?\s*\]\s*(?:[#;].*)?$')
+key_value = re.compile(r"^(?P<key>[a-z][\w-]*)\s*(?:=(?P<value>.*))?$", re.IGNORECASE)
+escapes = {"n": "\n", "t": "\t", "b": "\b", '"': '"', "\\": "\\"}
+git_environment = ("GIT_DIR", "GIT_COMMON_DIR", "GIT_WORK_TREE", "GIT_CONFIG", "GIT_CONFIG_PARAMETERS")
+
+
+class Unsupported(Exception):  # noqa: N818
+    """Something in the .git directory that is better left to git itself."""
+
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as fp:
+        return fp.read().strip()
+
+
+def _config_value(raw: str) -> str:
+    """Removes the comments, quotes and escapes from a value in a git config file."""
+    value = []
+    quoted = False
+    characters = iter(raw)
+    for character in characters:
+        if character == "\\":
+            escaped = next(characters, None)
+            if escaped not in escapes:  # A line continuation or an invalid escape
+                raise Unsupported(f"Can't interpret the config value {raw!r}")
+            value.append(escapes[escaped])
+        elif character == '"':
+            quoted = not quoted
+        elif character in "#;" and not quoted:
+            break
+        else:
+            value.append(character)
+
+    return "".join(value).strip()
+
+
+def parse_config(text: str) -> Dict[str, List[str]]:
+    """All the values per key ("section.subsection.key"), as `git config --get-all` would give them."""
+    config: Dict[str, List[str]] = {}
+    section = None
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+
+        if match := section_header.match(line):
+            section = match["section"].lower()
+            if match["subsection"] is not None:
+                section += "." + re.sub(r"\\(.)", r"\1", match["subsection"])
+            if section.split(".")[0] in ("include", "includeif"):
+                raise Unsupported("The git config includes other files")
+            continue
+
+        match = key_value.match(line)
+        if section is None or not match:
+            raise Unsupported(f"Can't interpret the config line {raw_line!r}")
+
+        value = "true" if match["value"] is None else _config_value(match["value"])
+        config.setdefault(f"{section}.{match['key'].lower()}", []).append(value)
+
+    return config
+
+
+@dataclass(frozen=True)
+class GitDirectory:
+    path: str  # The .git directory of this worktree: HEAD
+    common: str  # Shared by all the worktrees: the refs, packed-refs and config
+    _config: Dict[str, List[str]] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def head(self) -> str:
+        """The commit that is checked out."""
+        ref = _read(os.path.join(self.path, "HEAD"))
+        for _ in range(5):  # A symbolic ref can point to another symbolic ref
+            if object_id.match(ref):
+                return ref
+            if not ref.startswith("ref: "):
+                raise Unsupported(f"Can't interpret the ref {ref!r}")
+            ref = self.ref(ref[5:].strip())
+
+        raise Unsupported("Too many levels of symbolic refs")
+
+    def ref(self, name: str) -> str:
+        """What `name` (like "refs/heads/master") points to: a commit, or another ref."""
+        if self.config("extensions.refstorage") not in (None, "files"):
+            raise Unsupported("The refs aren't stored in files")
+
+        for directory in dict.fromkeys((self.path, self.common)):
+            try:
+                return _read(os.path.join(directory, name))
+            except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+                pass
+
+        if commit := self.packed_refs().get(name):
+            return commit
+
+        raise Unsupported(f"Unknown ref {name!r}")
+
+    def packed_refs(self) -> Dict[str, str]:
+        try:
+            text = _read(os.path.join(self.common, "packed-refs"))
+        except FileNotFoundError:
+            return {}
+
+        refs = {}
+        for line in text.splitlines():
+            if line.startswith(("#", "^")):  # The header, and the commits that annotated tags point to
+                continue
+            commit, _, name = line.partition(" ")
+            refs[name] = commit
+        return refs
+
+    def config(self, key: str) -> Optional[str]:
+        """The (last) value of `key`, as `git config --get` would give it, but only looking at the repository."""
+        if not self._config:
+            config = parse_config(_read(os.path.join(self.common, "config")))
+            if config.get("extensions.worktreeconfig", ["false"])[-1].lower() in ("true", "yes", "on", "1"):
+                raise Unsupported("The worktrees have their own config")
+            self._config.update(config)
+
+        section, _, name = key.rpartition(".")
+        section, dot, subsection = section.partition(".")  # Only the subsection is case sensitive
+        values = self._config.get(f"{section.lower()}{dot}{subsection}.{name.lower()}")
+        return values[-1] if values else None
+
+    def remote_urls(self) -> Dict[str, str]:
+        """The url of every remote, by name."""
+        self.config("remote.origin.url")  # Makes sure the config is read
+        return {
+            key[len("remote.") : -len(".url")]: values[-1]
+            for key, values in self._config.items()
+            if key.startswith("remote.") and key.endswith(".url") and key.count(".") >= 2
+        }
+
+
+def _git_directory(path: str) -> GitDirectory:
+    common = path
+    if os.path.isfile(commondir := os.path.join(path, "commondir")):  # A linked worktree
+        common = os.path.normpath(os.path.join(path, _read(commondir)))
+    return GitDirectory(path, common)
+
+
+def find_git_directory(start: str) -> GitDirectory:
+    """The git directory of the repository `start` is in, like git itself would find it."""
+    if any(name in os.environ for name in git_environment):
+        raise Unsupported("git is steered through the environment")
+
+    directory = os.path.abspath(start)
+    while True:
+        dot_git = os.path.join(directory, ".git")
+        if os.path.isdir(dot_git):
+            return _git_directory(dot_git)
+
+        if os.path.isfile(dot_git):  # A linked worktree or a submodule
+            content = _read(dot_git)
+            if not content.startswith("gitdir:"):
+                raise Unsupported(f"Can't interpret {dot_git}")
+            return _git_directory(os.path.normpath(os.path.join(directory, content[7:].strip())))
+
+        if directory == (parent := os.path.dirname(directory)):
+            raise Unsupported(f"{start} isn't inside a git repository")
+        directory = parent
@@ -0,0 +1,197 @@
+"""
+Keeps track of where the time goes: wall time, time spent in subprocesses, HTTP traffic and findings per stage.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from functools import wraps
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import cProfile
+
+__all__ = [
+    "StageStatistics",
+    "counted",
+    "dump_profile",
+    "enable_profiling",
+    "get_statistics",
+    "in_current_stage",
+    "record",
+    "reset",
+    "stage",
+    "summary",
+    "write_trace",
+]
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageStatistics:
+    calls: int = 0
+    wall_seconds: float = 0.0
+    subprocess_seconds: float = 0.0
+    requests: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    findings: int = 0
+
+
+_current_stage: ContextVar[str] = ContextVar("stage", default="other")
+_lock = threading.Lock()
+_local = threading.local()
+_statistics: Dict[str, StageStatistics] = {}
+_events: List[dict] = []
+_profiles: List["cProfile.Profile"] = []
+_profiling = False
+
+
+def reset() -> None:
+    global _profiling
+
+    with _lock:
+        _statistics.clear()
+        _events.clear()
+        _profiles.clear()
+        _profiling = False
+
+
+def get_statistics() -> Dict[str, StageStatistics]:
+    with _lock:
+        return {name: StageStatistics(**asdict(statistics)) for name, statistics in _statistics.items()}
+
+
+def record(**counters: float) -> None:
+    """Adds the counters (see StageStatistics) to the stage that is running right now."""
+    with _lock:
+        statistics = _statistics.setdefault(_current_stage.get(), StageStatistics())
+        for name, value in counters.items():
+            setattr(statistics, name, getattr(statistics, name) + value)
+
+
+def enable_profiling() -> None:
+    global _profiling
+    _profiling = True
+
+
+def _start_profile() -> Optional["cProfile.Profile"]:
+    if not _profiling or getattr(_local, "profile", None):
+        return None
+
+    import cProfile  # Only needed for --profile
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # python 3.12+ profiles all threads at once: the one of the main thread covers this one
+        return None
+
+    _local.profile = profile
+    return profile
+
+
+def _stop_profile(profile: Optional["cProfile.Profile"]) -> None:
+    if profile is None:
+        return
+
+    profile.disable()
+    _local.profile = None
+    with _lock:
+        _profiles.append(profile)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    token = _current_stage.set(name)
+    profile = _start_profile()
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _stop_profile(profile)
+        _current_stage.reset(token)
+
+        with _lock:
+            statistics = _statistics.setdefault(name, StageStatistics())
+            statistics.calls += 1
+            statistics.wall_seconds += elapsed
+            _events.append(
+                {"stage": name, "start": started, "seconds": elapsed, "thread": threading.current_thread().name}
+            )
+
+
+def in_current_stage(func: Callable[..., T]) -> Callable[..., T]:
+    """Makes `func` count towards the current stage, also when it's run on another thread."""
+    name = _current_stage.get()
+
+    @wraps(func)
+    def wrapper(*args: object, **kwargs: object) -> T:
+        token = _current_stage.set(name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_stage.reset(token)
+
+    return wrapper
+
+
+def counted(name: str, check: Callable[[], Iterable[T]]) -> Callable[[], Iterator[T]]:
+    """Runs the check as its own stage, and counts the findings it yields."""
+
+    @wraps(check)
+    def wrapper() -> Iterator[T]:
+        findings = 0
+        with stage(name):
+            try:
+                for captured_line in check():
+                    findings += 1
+                    yield captured_line
+            finally:
+                record(findings=findings)
+
+    return wrapper
+
+
+def summary() -> str:
+    header = f"{'stage':<20} {'calls':>6} {'wall (s)':>10} {'subprocess (s)':>15} {'requests':>9} {'sent':>12} "
+    header += f"{'received':>12} {'findings':>9}"
+    lines = [header, "-" * len(header)]
+
+    for name, statistics in get_statistics().items():
+        lines.append(
+            f"{name:<20} {statistics.calls:>6} {statistics.wall_seconds:>10.3f} {statistics.subprocess_seconds:>15.3f}"
+            f" {statistics.requests:>9} {statistics.bytes_sent:>12,} {statistics.bytes_received:>12,}"
+            f" {statistics.findings:>9,}"
+        )
+
+    return "\n".join(lines)
+
+
+def write_trace(path: str) -> None:
+    with _lock:
+        events = list(_events)
+
+    trace = {"stages": {name: asdict(statistics) for name, statistics in get_statistics().items()}, "events": events}
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(trace, fp, indent=2)
+
+
+def dump_profile(path: str) -> None:
+    with _lock:
+        profiles = list(_profiles)
+
+    if not profiles:
+        return
+
+    import pstats  # Only needed for --profile
+
+    stats = pstats.Stats(profiles[0])
+    stats.add(*profiles[1:])
+    stats.dump_stats(path)
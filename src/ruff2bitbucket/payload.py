@@ -0,0 +1,99 @@
+"""
+Request bodies that are serialized while they are sent, so a big set of annotations never exists as one string.
+"""
+
+import json
+import logging
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator
+
+from .arguments import get_arguments
+
+__all__ = ["Compression", "JsonStream", "get_compression", "truncate"]
+
+logger = logging.getLogger(__name__)
+
+chunk_size = 64 * 1024
+ellipsis = "…"
+_encode = json.JSONEncoder(separators=(",", ":"), allow_nan=False).encode
+
+
+def truncate(text: str, max_bytes: int) -> str:
+    """Cuts `text` to at most `max_bytes` bytes of utf-8, on a character boundary, ending in an ellipsis if it fits."""
+    encoded = text.encode("utf-8")
+    if max_bytes <= 0 or len(encoded) <= max_bytes:
+        return text
+    if max_bytes <= len(ellipsis.encode("utf-8")):  # No room for the ellipsis
+        return encoded[:max_bytes].decode("utf-8", "ignore")
+    return encoded[: max_bytes - len(ellipsis.encode("utf-8"))].decode("utf-8", "ignore") + ellipsis
+
+
+class JsonStream:
+    """
+    `{"<key>": [<item>, ...]}` as a chunked request body: the items are only made and serialized while it is sent.
+    It can be iterated more than once (`items` is called every time), so a retry sends the same body again.
+    """
+
+    def __init__(self, key: str, items: Callable[[], Iterable[dict]], compress: bool = False) -> None:
+        self.key = key
+        self.items = items
+        self.compress = compress
+        self.size = 0  # Bytes on the wire the last time it was sent
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        return headers
+
+    def uncompressed(self) -> "JsonStream":
+        return JsonStream(self.key, self.items)
+
+    def _chunks(self) -> Iterator[bytes]:
+        buffer = [f"{{{_encode(self.key)}:["]
+        length = 0
+        for idx, item in enumerate(self.items()):
+            text = _encode(item)
+            buffer.append(f",{text}" if idx else text)
+            length += len(text)
+            if length >= chunk_size:
+                yield "".join(buffer).encode("utf-8")
+                buffer.clear()
+                length = 0
+
+        buffer.append("]}")
+        yield "".join(buffer).encode("utf-8")
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.size = 0
+        compressor = zlib.compressobj(wbits=31) if self.compress else None  # 31: with a gzip header
+        for chunk in self._chunks():
+            data = compressor.compress(chunk) if compressor else chunk
+            if data:
+                self.size += len(data)
+                yield data
+
+        if compressor:
+            data = compressor.flush()
+            self.size += len(data)
+            yield data
+
+
+@dataclass
+class Compression:
+    """Whether request bodies are gzipped. Once BitBucket refuses them (415), they aren't anymore."""
+
+    enabled: bool
+
+    def refused(self) -> None:
+        if self.enabled:
+            logger.info("BitBucket doesn't accept compressed requests, they are sent uncompressed.")
+            self.enabled = False
+
+
+@lru_cache(1)
+def get_compression() -> Compression:
+    return Compression(get_arguments().compress)
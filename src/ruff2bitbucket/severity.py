@@ -0,0 +1,87 @@
+"""
+Which severity (LOW, MEDIUM or HIGH) and type (BUG, CODE_SMELL or VULNERABILITY) a finding gets on BitBucket.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+
+from .arguments import get_arguments
+from .common import CapturedLine
+
+__all__ = ["RuleTable", "get_rule_table", "severities", "types"]
+
+severities = ("LOW", "MEDIUM", "HIGH")  # From least to most important
+types = ("CODE_SMELL", "BUG", "VULNERABILITY")
+rule_code = re.compile(r"^(?P<linter>[A-Z]*)(?P<number>\d*)$")
+
+# A rule is a linter prefix, optionally followed by the start of the rule numbers: "S" (all of bandit), "E9", "F821".
+default_rules = {
+    "E9": ("HIGH", "BUG"),  # Syntax and io errors
+    "F63": ("MEDIUM", "BUG"),  # Invalid comparisons
+    "F7": ("HIGH", "BUG"),  # break/continue/return/yield in the wrong place
+    "F82": ("HIGH", "BUG"),  # Undefined names
+    "PLE": ("HIGH", "BUG"),  # pylint errors
+    "B": ("MEDIUM", "BUG"),  # bugbear
+    "ASYNC": ("MEDIUM", "BUG"),
+    "RUF006": ("MEDIUM", "BUG"),  # Dangling asyncio task
+    "PLW": ("MEDIUM", "CODE_SMELL"),  # pylint warnings
+    "C90": ("MEDIUM", "CODE_SMELL"),  # Too complex
+    "S": ("HIGH", "VULNERABILITY"),  # bandit
+}
+syntax_error = ("HIGH", "BUG")
+default = ("LOW", "CODE_SMELL")
+
+
+def _split(rule: str) -> Tuple[str, str]:
+    match = rule_code.match(rule.upper())
+    return (match["linter"], match["number"]) if match else (rule.upper(), "")
+
+
+class RuleTable:
+    """Finds the most specific rule for a code. The outcome is remembered per code, as there are few of them."""
+
+    def __init__(self, rules: Dict[str, Tuple[str, str]]) -> None:
+        for rule, (severity, type_) in rules.items():
+            if severity not in severities or type_ not in types:
+                raise ValueError(f"Invalid severity/type for '{rule}': {severity}/{type_}.")
+
+        self._rules = {_split(rule): classification for rule, classification in rules.items()}
+        self._cache: Dict[str, Tuple[str, str]] = {}
+
+    def lookup(self, code: str) -> Tuple[str, str]:
+        """(severity, type) of the rule `code`."""
+        if (classification := self._cache.get(code)) is None:
+            linter, number = _split(code)
+            classification = next(
+                (
+                    self._rules[linter, number[:length]]
+                    for length in range(len(number), -1, -1)
+                    if (linter, number[:length]) in self._rules
+                ),
+                default,
+            )
+            self._cache[code] = classification
+        return classification
+
+    def classify(self, captured_line: CapturedLine) -> Tuple[str, str]:
+        if not captured_line.code:  # ruff gives syntax errors without a code. The rest is about formatting.
+            return syntax_error if captured_line.description.startswith("SyntaxError") else default
+        return self.lookup(captured_line.code)
+
+
+def parse_rules(options: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+    """Interprets --severity RULE=SEVERITY[:TYPE] options."""
+    rules = {}
+    for option in options:
+        rule, _, classification = option.partition("=")
+        severity, _, type_ = classification.upper().partition(":")
+        if not rule or not severity:
+            raise ValueError(f"Expected RULE=SEVERITY[:TYPE], not '{option}'.")
+        rules[rule.strip()] = (severity.strip(), type_.strip() or default[1])
+    return rules
+
+
+@lru_cache(1)
+def get_rule_table() -> RuleTable:
+    return RuleTable({**default_rules, **parse_rules(get_arguments().severity or [])})
@@ -0,0 +1,79 @@
+import glob
+import gzip
+import json
+import logging
+import os
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from .aggregation import FindingStatistics
+from .arguments import get_arguments
+from .bitbucket import RepoInfo
+from .common import CapturedLine
+
+__all__ = ["Spool", "get_spool"]
+
+logger = logging.getLogger(__name__)
+
+_columns = [field.name for field in fields(CapturedLine)]
+
+
+@dataclass
+class Spool:
+    """
+    A queue on disk with the findings that still need to be uploaded, one (gzipped json) file per commit.
+    The report and the annotations are made from the findings and their statistics when they're uploaded, exactly like
+    a normal run does.
+    """
+
+    directory: str
+
+    def path(self, commit_id: str) -> str:
+        return os.path.join(self.directory, f"{commit_id}.json.gz")
+
+    def put(self, repo_info: RepoInfo, statistics: FindingStatistics, captured_lines: List[CapturedLine]) -> str:
+        """Stores the findings for the commit, replacing what was there for that commit already."""
+        content = {
+            "version": 1,
+            "repository": vars(repo_info),
+            "statistics": vars(statistics),  # The findings might be capped, the statistics are about all of them
+            "columns": _columns,
+            "findings": [[getattr(captured_line, name) for name in _columns] for captured_line in captured_lines],
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(repo_info.commit_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as fp:
+            json.dump(content, fp, separators=(",", ":"))
+        os.replace(temp_path, path)  # Another process flushing the spool never sees half a file
+        return path
+
+    def entries(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(self.directory), "*.json.gz")))
+
+    def load(self, path: str) -> Tuple[RepoInfo, FindingStatistics, List[CapturedLine]]:
+        with gzip.open(path, "rt", encoding="utf-8") as fp:
+            content = json.load(fp)
+
+        if content.get("version") != 1:
+            raise ValueError(f"Unknown version of spooled file '{path}'.")
+
+        columns = content["columns"]
+        captured_lines = [CapturedLine.parse(**dict(zip(columns, row))) for row in content["findings"]]
+        return RepoInfo.restore(content["repository"]), FindingStatistics.restore(content["statistics"]), captured_lines
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # Flushed by somebody else in the meantime
+            logger.debug("'%s' was already removed.", path)
+
+
+@lru_cache(1)
+def get_spool() -> Optional[Spool]:
+    args = get_arguments()
+    if not args.spool_dir:
+        return None
+    return Spool(args.spool_dir)
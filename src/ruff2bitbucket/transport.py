@@ -0,0 +1,196 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from time import sleep
+from typing import Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .arguments import get_arguments
+from .instrumentation import record
+from .payload import JsonStream
+
+__all__ = ["CircuitOpenError", "RetryPolicy", "get_retry_policy", "get_session", "request", "retry_budget"]
+
+logger = logging.getLogger(__name__)
+
+retry_statuses = frozenset({429, 500, 502, 503, 504})
+idempotent_methods = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_budget: ContextVar[Optional[Counter]] = ContextVar("retry_budget", default=None)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """BitBucket failed too many times in a row, so it isn't even contacted anymore."""
+
+
+def _parse_retry_after(value: object) -> Optional[float]:
+    """'Retry-After' is either a number of seconds or an HTTP date."""
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    retries: int
+    backoff: float
+    max_wait: float
+    endpoint_budget: int
+    breaker_threshold: int
+    breaker_cooldown: float = 30.0
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    _spent: Counter = field(default_factory=Counter, init=False, repr=False)
+    _failures: int = field(default=0, init=False, repr=False)
+    _opened_at: Optional[float] = field(default=None, init=False, repr=False)
+
+    def delay(self, attempt: int, retry_after: object = None) -> float:
+        """Exponential backoff with full jitter, unless BitBucket told us how long to wait."""
+        wait = _parse_retry_after(retry_after)
+        if wait is None:
+            wait = random.uniform(0, self.backoff * 2**attempt)
+        return min(wait, self.max_wait)
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if time.monotonic() - self._opened_at < self.breaker_cooldown:
+                return False
+
+            self._opened_at = time.monotonic()  # Half open: one call may find out if BitBucket is back
+            return True
+
+    def allow_retry(self, endpoint: str) -> bool:
+        """Every endpoint has a budget of retries, shared by all the calls to it (within one `retry_budget`)."""
+        spent = _budget.get()
+        if spent is None:
+            spent = self._spent
+
+        with self._lock:
+            if spent[endpoint] >= self.endpoint_budget:
+                return False
+
+            spent[endpoint] += 1
+            return True
+
+    def report(self, *, success: bool) -> None:
+        with self._lock:
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+
+            self._failures += 1
+            if self._failures >= self.breaker_threshold:
+                self._opened_at = time.monotonic()
+
+
+@contextmanager
+def retry_budget() -> Iterator[None]:
+    """
+    The calls in here get a budget of retries of their own: one upload. A daemon or batch keeps the policy (and its
+    circuit breaker) for all its jobs, but one job must not use up the retries of the next.
+    """
+    token = _budget.set(Counter())
+    try:
+        yield
+    finally:
+        _budget.reset(token)
+
+
+@lru_cache(1)
+def get_retry_policy() -> RetryPolicy:
+    args = get_arguments()
+    return RetryPolicy(
+        retries=args.retries,
+        backoff=args.retry_backoff,
+        max_wait=args.retry_max_wait,
+        endpoint_budget=args.retry_budget,
+        breaker_threshold=args.circuit_breaker,
+    )
+
+
+@lru_cache(1)
+def get_session() -> requests.Session:
+    """One session for all the calls, so the TCP/TLS connections to BitBucket are kept alive and reused."""
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=get_arguments().pool_size)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _size(body: object) -> int:
+    if isinstance(body, JsonStream):
+        return body.size
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+def _send(method: str, url: str, **kwargs: object) -> requests.Response:
+    args = get_arguments()
+    response = get_session().request(method, url, timeout=(args.connect_timeout, args.read_timeout), **kwargs)
+
+    record(
+        requests=1,
+        bytes_sent=_size(getattr(response.request, "body", None)),
+        bytes_received=_size(response.content),
+    )
+    return response
+
+
+def request(method: str, url: str, **kwargs: object) -> requests.Response:
+    """
+    Calls BitBucket, retrying when it is overloaded (429/5xx) or unreachable.
+    A call that timed out waiting for the answer is only retried when doing it twice is harmless (not for POST).
+    The last response is returned (or the last exception raised) once the retries run out.
+    """
+    policy = get_retry_policy()
+    endpoint = f"{method} {url}"
+
+    attempt = 0
+    while True:
+        if not policy.allow_request():
+            raise CircuitOpenError(f"BitBucket keeps failing, not calling '{endpoint}' anymore.")
+
+        try:
+            response = _send(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as ex:
+            policy.report(success=False)
+            if isinstance(ex, requests.ReadTimeout) and method not in idempotent_methods:
+                raise  # BitBucket may have handled it already: sending it again could store it twice
+            if attempt >= policy.retries or not policy.allow_retry(endpoint):
+                raise
+            reason, retry_after = str(ex), None
+        else:
+            policy.report(success=response.status_code < 500)
+            if response.status_code not in retry_statuses or attempt >= policy.retries:
+                return response
+            if not policy.allow_retry(endpoint):
+                return response
+            reason, retry_after = f"HTTP status {response.status_code}", response.headers.get("Retry-After")
+
+        wait = policy.delay(attempt, retry_after)
+        logger.info("'%s' failed (%s), retrying in %.1f seconds.", endpoint, reason, wait)
+        sleep(wait)
+        attempt += 1
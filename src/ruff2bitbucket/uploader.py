@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode
+
+import requests
+
+from .aggregation import FindingStatistics
+from .arguments import get_arguments
+from .bitbucket import RepoInfo, annotation_severity, annotation_type
+from .common import CapturedLine, batched
+from .credentials import UserPass, get_credentials
+from .instrumentation import stage
+from .payload import JsonStream, get_compression, truncate
+from .transport import request, retry_budget, retry_statuses
+
+__all__ = ["upload"]
+
+logger = logging.getLogger(__name__)
+
+not_about_the_body = frozenset({401, 403, 404, 429})  # Answers a compressed body can get that aren't about the gzip
+
+
+async def find_valid_credential(probe_uri: str) -> Optional[UserPass]:
+    """
+    Tries all candidate user/passwords at the same time against a cheap endpoint and keeps the first one that works.
+    This way the (big) reports only need to be uploaded once.
+    """
+
+    credentials = get_credentials()
+    cached = credentials.cached_combination()
+    if cached:
+        return cached
+
+    candidates = list(credentials)
+    if len(candidates) <= 1:
+        return next(iter(candidates), None)  # Nothing to choose from: the upload itself will tell if it's wrong
+
+    semaphore = asyncio.Semaphore(get_arguments().pool_size)
+
+    async def probe(candidate: UserPass) -> Optional[UserPass]:
+        async with semaphore:
+            try:
+                response = await asyncio.to_thread(request, "GET", probe_uri, auth=candidate.as_tuple())
+            except requests.RequestException as ex:  # Not proven to work, like a wrong one
+                logger.warning("Trying the user/pass of '%s' failed: %s", candidate.username, ex)
+                return None
+        if response.status_code == 401:  # Unauthorized
+            return None
+        if not 200 <= response.status_code < 300 and response.status_code not in (403, 404):  # Those know the user
+            logger.warning(
+                "Trying the user/pass of '%s' failed with HTTP status %d", candidate.username, response.status_code
+            )
+            return None
+        return candidate
+
+    tasks = [asyncio.create_task(probe(candidate)) for candidate in candidates]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            winner = await next_done
+            if winner:
+                credentials.report_correct_combination(winner)
+                return winner
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return None
+
+
+def _send(
+    method: str, upload_uri: str, report: Union[dict, JsonStream, None], credential: UserPass
+) -> requests.Response:
+    if not isinstance(report, JsonStream):
+        return request(method, upload_uri, json=report, auth=credential.as_tuple())
+
+    response = request(method, upload_uri, data=report, headers=report.headers, auth=credential.as_tuple())
+    if report.compress and 400 <= response.status_code < 500 and response.status_code not in not_about_the_body:
+        # 415 Unsupported Media Type: no gzip. A server that ignores the Content-Encoding finds no json in it: 400
+        report = report.uncompressed()
+        retried = request(method, upload_uri, data=report, headers=report.headers, auth=credential.as_tuple())
+        if response.status_code == 415 or retried.status_code < 400:
+            get_compression().refused()
+        return retried
+    return response
+
+
+def bitbucket_upload(
+    upload_uri: str,
+    report: Union[dict, JsonStream, None],
+    name: str,
+    error_code: Optional[int],
+    method: str = "PUT",
+) -> requests.Response:
+    for credential in get_credentials():
+        response = _send(method, upload_uri, report, credential)
+        if response.status_code == 401:  # Unauthorized
+            continue
+
+        get_credentials().report_correct_combination(credential)
+
+        if response.status_code == error_code:
+            logger.warning("'%s %s' reported one or more errors:", method, upload_uri)
+            text = json.dumps(response.json(), indent=4).splitlines()
+            for line in text:
+                logger.warning("%s", line)
+        return response  # But my authentication user was right, so we will stop here
+
+    logger.error("Cannot upload the %s to bitbucket. No valid user/pass found.", name)
+    sys.exit(1)
+
+
+def bitbucket_get(uri: str, name: str) -> Optional[dict]:
+    """What BitBucket has stored at `uri`, or None when there is nothing (or it can't be read)."""
+    try:
+        response = bitbucket_upload(uri, report=None, name=name, error_code=None, method="GET")
+    except requests.RequestException as ex:
+        logger.warning("Reading the %s failed: %s", name, ex)
+        return None
+
+    if response.status_code != 200:
+        return None
+    return response.json()
+
+
+def external_id(captured_line: CapturedLine) -> str:
+    """Identifies an annotation across runs: the same message on the same line always gets the same id."""
+    key = f"{captured_line.filename}\0{captured_line.line}\0{captured_line.description}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def annotation(captured_line: CapturedLine, with_id: bool = False) -> dict:
+    result = {
+        "reportKey": "ruff2bitbucket",
+        "path": captured_line.filename,
+        "line": captured_line.line,
+        "message": truncate(captured_line.description, get_arguments().max_message_bytes),
+        "severity": annotation_severity(captured_line),
+        "type": annotation_type(captured_line),
+    }
+    if with_id:
+        result["externalId"] = external_id(captured_line)
+    return result
+
+
+def upload_annotation_batch(upload_uri: str, batch: List[CapturedLine], batch_number: int) -> bool:
+    with_id = get_arguments().reconcile
+    body = JsonStream(
+        "annotations", lambda: (annotation(message, with_id) for message in batch), get_compression().enabled
+    )
+
+    name = f"annotations (batch {batch_number})"
+    try:  # The retries already happened in the transport
+        response = bitbucket_upload(upload_uri, report=body, name=name, error_code=404, method="POST")
+    except requests.RequestException as ex:
+        logger.warning("Uploading the %s failed: %s", name, ex)
+        return False
+
+    if response.status_code >= 300:  # The errors BitBucket reported are logged already
+        logger.warning("Uploading the %s failed with HTTP status %d", name, response.status_code)
+        return False
+
+    return True
+
+
+async def upload_code_insights(upload_uri: str, captured_lines: List[CapturedLine]) -> None:
+    args = get_arguments()
+    batches = list(batched(captured_lines, args.annotation_batch_size))  # Bitbucket takes 1000 annotations per call
+    semaphore = asyncio.Semaphore(args.upload_concurrency)
+
+    async def send(batch: List[CapturedLine], batch_number: int) -> bool:
+        async with semaphore:
+            return await asyncio.to_thread(upload_annotation_batch, upload_uri, batch, batch_number)
+
+    succeeded = await asyncio.gather(*(send(batch, number) for number, batch in enumerate(batches, start=1)))
+
+    if not all(succeeded):
+        logger.error(
+            "Cannot upload %d of the %d annotation batches to bitbucket.", succeeded.count(False), len(batches)
+        )
+        sys.exit(1)
+
+
+def compare_annotations(
+    existing: List[dict], captured_lines: List[CapturedLine]
+) -> Tuple[List[CapturedLine], Optional[List[str]]]:
+    """
+    The findings that aren't annotated yet, and the ids of the annotations that have to go (None: all of them).
+    The existing annotations are indexed on their id, so this is linear in the number of annotations.
+    """
+    wanted: Dict[str, CapturedLine] = {}
+    for captured_line in captured_lines:
+        wanted.setdefault(external_id(captured_line), captured_line)  # The same message twice on a line is shown once
+
+    if any("externalId" not in existing_annotation for existing_annotation in existing):
+        return list(wanted.values()), None  # Not uploaded with --reconcile: they can't be matched
+
+    fields = ("path", "line", "message", "severity", "type")
+    unchanged = set()
+    for existing_annotation in existing:
+        captured_line = wanted.get(existing_annotation["externalId"])
+        if captured_line is not None:
+            new = annotation(captured_line)
+            if all(existing_annotation.get(name, 0 if name == "line" else None) == new[name] for name in fields):
+                unchanged.add(existing_annotation["externalId"])
+
+    additions = [captured_line for id_, captured_line in wanted.items() if id_ not in unchanged]
+    stale = [existing_annotation["externalId"] for existing_annotation in existing]
+    return additions, [id_ for id_ in stale if id_ not in unchanged]
+
+
+def delete_annotations(upload_uri: str, external_ids: Optional[List[str]]) -> None:
+    """Deletes the annotations with these ids (a limited number per call, for the url), or all of them (None)."""
+    queries = (
+        [""]
+        if external_ids is None
+        else ["?" + urlencode([("externalId", id_) for id_ in batch]) for batch in batched(external_ids, 50)]
+    )
+    for query in queries:
+        try:
+            response = bitbucket_upload(
+                upload_uri + query, report=None, name="stale annotations", error_code=None, method="DELETE"
+            )
+        except requests.RequestException as ex:
+            logger.error("Cannot delete the stale annotations from bitbucket: %s", ex)
+            sys.exit(1)
+
+        if response.status_code >= 300:
+            logger.error("Cannot delete the stale annotations from bitbucket: HTTP status %d", response.status_code)
+            sys.exit(1)
+
+
+async def reconcile_code_insights(upload_uri: str, captured_lines: List[CapturedLine]) -> None:
+    """Only sends the annotations BitBucket doesn't have yet, and removes the ones that no longer apply."""
+    stored = await asyncio.to_thread(bitbucket_get, upload_uri, "existing annotations")
+    existing = stored.get("annotations", []) if stored else []
+
+    additions, stale = compare_annotations(existing, captured_lines)
+    removed = len(existing) if stale is None else len(stale)
+    if removed:
+        await asyncio.to_thread(delete_annotations, upload_uri, stale)
+    logger.info("%d annotations added, %d removed and %d unchanged.", len(additions), removed, len(existing) - removed)
+    await upload_code_insights(upload_uri, additions)
+
+
+def most_common(counter: Counter, amount: int = 5) -> str:
+    return ", ".join(f"{key} ({count})" for key, count in counter.most_common(amount))
+
+
+def is_stored(upload_uri: str, report: dict) -> bool:
+    """Whether BitBucket already has this report."""
+    stored = bitbucket_get(upload_uri, "existing report")
+    return stored is not None and all(stored.get(key) == report[key] for key in ("title", "reporter", "result", "data"))
+
+
+def upload_code_statistics(upload_uri: str, statistics: FindingStatistics) -> None:
+    data = [
+        {"title": "Need reformat", "type": "NUMBER", "value": statistics.need_reformat},
+        {"title": "Issue count", "type": "NUMBER", "value": statistics.issues},
+        {"title": "Files affected", "type": "NUMBER", "value": len(statistics.per_file)},
+    ]
+    # Bitbucket shows at most 6 data fields
+    for title, counter in (
+        ("Top rules", statistics.per_rule),
+        ("Most affected files", statistics.per_file),
+        ("Severities", statistics.per_severity),
+    ):
+        if counter:
+            data.append({"title": title, "type": "TEXT", "value": most_common(counter)})
+
+    report = {
+        "result": "FAIL" if statistics.findings else "PASS",
+        "title": "ruff report",
+        "reporter": "ruff2bitbucket",
+        "report_type": "CODE_SMELL",
+        "data": data,
+    }
+
+    if get_arguments().reconcile and is_stored(upload_uri, report):
+        logger.info("The report didn't change, so it isn't uploaded again.")
+        return
+
+    try:
+        response = bitbucket_upload(upload_uri, report=report, name="report", error_code=400)
+    except requests.RequestException as ex:
+        logger.error("Cannot upload the report to bitbucket: %s", ex)
+        sys.exit(1)
+
+    if response.status_code in retry_statuses:
+        logger.error("Cannot upload the report to bitbucket: HTTP status %d", response.status_code)
+        sys.exit(1)
+
+
+async def upload(repo_info: RepoInfo, statistics: FindingStatistics, captured_lines: List[CapturedLine]) -> None:
+    """
+    Uploads everything with one credential and one connection pool.
+    The report has to exist before annotations can be added to it, after that the batches go out concurrently.
+    """
+
+    with retry_budget():
+        with stage("credentials"):
+            if not await find_valid_credential(repo_info.repository_endpoint):
+                logger.error("Cannot upload to bitbucket. No valid user/pass found.")
+                sys.exit(1)
+
+        with stage("upload report"):
+            await asyncio.to_thread(upload_code_statistics, repo_info.report_endpoint, statistics)
+        with stage("upload annotations"):
+            if get_arguments().reconcile:
+                await reconcile_code_insights(repo_info.annotations_endpoint, captured_lines)
+            else:
+                await upload_code_insights(repo_info.annotations_endpoint, captured_lines)
@@ -1,14 +1,50 @@
+import json
 import logging
 import os
 import subprocess
 import sys
+from typing import Iterator
 
 import pytest
 from pytest_mock import MockerFixture
 
+from ruff2bitbucket.arguments import get_arguments
 from ruff2bitbucket.bitbucket import get_repo_info
+from ruff2bitbucket.cache import get_result_cache
 from ruff2bitbucket.credentials import get_credentials
-from ruff2bitbucket.git import get_current_git_commit_hash, get_current_repo_uri
+from ruff2bitbucket.git import get_current_git_commit_hash, get_current_repo_uri, get_remote_urls
+from ruff2bitbucket.gitdir import Unsupported
+from ruff2bitbucket.payload import get_compression
+from ruff2bitbucket.severity import get_rule_table
+from ruff2bitbucket.spool import get_spool
+from ruff2bitbucket.transport import get_retry_policy, get_session
+
+
+def ruff_violation(filename: str, row: int, column: int, code: str, message: str, fixable: bool) -> str:
+    return json.dumps(
+        {
+            "cell": None,
+            "code": code,
+            "end_location": {"column": column + 5, "row": row},
+            "filename": os.path.join(os.getcwd(), filename),
+            "fix": {"applicability": "safe", "edits": [], "message": None} if fixable else None,
+            "location": {"column": column, "row": row},
+            "message": message,
+            "noqa_row": row,
+            "url": f"https://docs.astral.sh/ruff/rules/{code}",
+        }
+    )
+
+
+def ruff_check_output() -> str:
+    return (
+        ruff_violation("src/some_repo/filter/fltr.py", 337, 21, "G004", "Logging statement uses f-string", False)
+        + "\n"
+        + ruff_violation(
+            "src/some_repo/filter/wrk.py", 24, 66, "Q000", "Single quotes found but double quotes preferred", True
+        )
+        + "\n"
+    )
 
 
 @pytest.fixture(autouse=True)
@@ -30,21 +66,11 @@ def _inject_run_commands(mocker: MockerFixture) -> None:
             assert check is True
             return subprocess.CompletedProcess("", 0, "abcde_commit_hash_fghij\n\n")
 
-        if cmd == ("ruff", "check", "--no-fix", "."):
+        if cmd == ("ruff", "check", "--no-fix", "--force-exclude", "--output-format=json-lines", "."):
             assert check is False
-            return subprocess.CompletedProcess(
-                "",
-                0,
-                (
-                    "src/some_repo/filter/fltr.py:337:21: G004 Logging statement uses f-string\n"
-                    "src/some_repo/filter/wrk.py:24:66: Q000 [*] Single quotes found but double quotes preferred\n"
-                    "[..]\n"
-                    "Found 1592 errors.\n"
-                    "[*] 993 fixable with the `--fix` option (218 hidden fixes can be enabled with the `--unsafe-fixes` option).\n"  # noqa: E501
-                ),
-            )
+            return subprocess.CompletedProcess("", 0, ruff_check_output())
 
-        if cmd == ("ruff", "format", "--check", "."):
+        if cmd == ("ruff", "format", "--check", "--force-exclude", "."):
             assert check is False
             return subprocess.CompletedProcess(
                 "",
@@ -58,8 +84,17 @@ def _inject_run_commands(mocker: MockerFixture) -> None:
 
         raise ValueError(f"Unknown call to: {cmd}")
 
+    def local_stream(*cmd: str) -> Iterator[str]:
+        yield from local_run(*cmd, check=False).stdout.splitlines(keepends=True)
+
     mocker.patch("ruff2bitbucket.git.run", new=local_run)
-    mocker.patch("ruff2bitbucket.capturer.run", new=local_run)
+    mocker.patch("ruff2bitbucket.git.find_git_directory", side_effect=Unsupported("The tests use the git commands"))
+    mocker.patch("ruff2bitbucket.capturer.stream", new=local_stream)
+
+
+@pytest.fixture(autouse=True)
+def _no_retry_waits(mocker: MockerFixture) -> None:
+    mocker.patch("ruff2bitbucket.transport.sleep")
 
 
 @pytest.fixture(autouse=True)
@@ -71,10 +106,18 @@ def _enable_all_executables(mocker: MockerFixture) -> None:
 def _cleanup_caches() -> None:
     yield
 
+    get_arguments.cache_clear()
     get_credentials.cache_clear()
+    get_session.cache_clear()
+    get_retry_policy.cache_clear()
     get_repo_info.cache_clear()
+    get_result_cache.cache_clear()
+    get_spool.cache_clear()
+    get_rule_table.cache_clear()
+    get_compression.cache_clear()
     get_current_git_commit_hash.cache_clear()
     get_current_repo_uri.cache_clear()
+    get_remote_urls.cache_clear()
 
 
 @pytest.fixture(autouse=True)
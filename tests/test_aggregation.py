@@ -0,0 +1,52 @@
+import json
+
+from ruff2bitbucket.aggregation import FindingStatistics, is_reformat, most_important
+from ruff2bitbucket.common import CapturedLine
+
+
+def test_is_reformat() -> None:
+    assert is_reformat(CapturedLine("a.py", description="Would reformat"))
+    assert not is_reformat(CapturedLine("a.py", description="F401 [*] reformat", code="F401"))
+    assert not is_reformat(CapturedLine("a.py", description="F401 unused", code="F401"))
+
+
+def test_collect_counts_in_one_pass() -> None:
+    findings = [
+        CapturedLine("a.py", 1, description="F401 unused", code="F401"),
+        CapturedLine("a.py", 2, description="E501 too long", code="E501"),
+        CapturedLine("b.py", 3, description="F401 unused", code="F401"),
+        CapturedLine("c.py", 4, description="SyntaxError: oops"),
+        CapturedLine("a.py", description="Would reformat"),
+    ]
+    sut = FindingStatistics()
+
+    assert list(sut.collect(iter(findings))) == findings
+    assert sut.findings == 5
+    assert sut.need_reformat == 1
+    assert sut.issues == 4
+    assert sut.per_rule == {"F401": 2, "E501": 1, "other": 1}
+    assert sut.per_file == {"a.py": 3, "b.py": 1, "c.py": 1}
+    assert sut.per_severity == {"LOW": 4, "HIGH": 1}
+
+
+def test_most_important() -> None:
+    findings = [
+        CapturedLine("a.py", 1, code="E501"),
+        CapturedLine("a.py", 2, code="B006"),
+        CapturedLine("a.py", 3, code="F401"),
+        CapturedLine("b.py", 4, code="S101"),
+        CapturedLine("b.py", 5, code="B008"),
+        CapturedLine("c.py", 6, code="F821"),
+    ]
+
+    assert most_important(iter(findings), 3) == [findings[1], findings[3], findings[5]]
+    assert most_important(iter(findings), 4) == [findings[1], findings[3], findings[4], findings[5]]
+    assert most_important(iter(findings), 100) == findings
+    assert most_important(iter(findings), 0) == []
+
+
+def test_restore_statistics() -> None:
+    sut = FindingStatistics()
+    list(sut.collect([CapturedLine("a.py", 1, code="F401"), CapturedLine("a.py", description="Would reformat")]))
+
+    assert FindingStatistics.restore(json.loads(json.dumps(vars(sut)))) == sut
@@ -1,9 +1,10 @@
 import subprocess
+import sys
 
 import pytest
 from pytest_mock import MockerFixture
 
-from ruff2bitbucket.bitbucket import get_repo_info
+from ruff2bitbucket.bitbucket import Remote, get_repo_info, parse_remote
 
 
 def test_get_repo_info(mocker: MockerFixture) -> None:
@@ -27,6 +28,7 @@ def test_repo_info_happy_flow() -> None:
     assert sut.commit_url == "https://localhost:12345/projects/abc/repos/repository/commits/abcde_commit_hash_fghij"
     assert sut.repo_key == "abc"
     assert sut.repo_slug == "repository"
+    assert sut.repository_endpoint == "https://localhost:12345/rest/api/latest/projects/abc/repos/repository"
     assert (
         sut.report_endpoint
         == "https://localhost:12345/rest/insights/latest/projects/abc/repos/repository/commits/abcde_commit_hash_fghij/reports/ruff2bitbucket"
@@ -80,3 +82,118 @@ def test_repo_info_no_url(mocker: MockerFixture) -> None:
 
     with pytest.raises(ValueError, match=r"No git has been set up"):
         get_repo_info()
+
+
+@pytest.mark.parametrize(
+    ("url", "expected"),
+    [
+        ("https://host/scm/abc/repo.git", Remote("https://host", "abc", "repo")),
+        ("https://user@host:8443/bitbucket/scm/abc/repo.git", Remote("https://host:8443/bitbucket", "abc", "repo")),
+        ("http://host/scm/~jdoe/repo.git", Remote("http://host", "~jdoe", "repo")),
+        ("https://host/projects/ABC/repos/repo/browse", Remote("https://host", "ABC", "repo")),
+        ("https://host/users/jdoe/repos/repo/browse", Remote("https://host", "~jdoe", "repo")),
+        ("ssh://git@host:7999/abc/repo.git", Remote("https://host", "abc", "repo")),
+        ("ssh://git@host:7999/~jdoe/repo.git", Remote("https://host", "~jdoe", "repo")),
+        ("git@host:abc/repo.git", Remote("https://host", "abc", "repo")),
+        ("https://github.com/user/repo.git", None),
+        ("", None),
+    ],
+)
+def test_parse_remote(url: str, expected: Remote) -> None:
+    assert parse_remote(url) == expected
+
+
+def test_parse_remote_is_cached() -> None:
+    parse_remote.cache_clear()
+
+    parse_remote("ssh://git@host:7999/abc/repo.git")
+    parse_remote("ssh://git@host:7999/abc/repo.git")
+
+    assert parse_remote.cache_info().hits == 1
+
+
+def _remotes(mocker: MockerFixture, origin: str, others: str) -> None:
+    def local_run(*cmd: str, check: bool) -> subprocess.CompletedProcess:  # noqa: ARG001
+        if cmd == ("git", "config", "--get", "remote.origin.url"):
+            if not origin:
+                raise subprocess.CalledProcessError(1, cmd)
+            return subprocess.CompletedProcess("", 0, origin)
+        if cmd[:3] == ("git", "config", "--get-regexp"):
+            return subprocess.CompletedProcess("", 0, others)
+        return subprocess.CompletedProcess("", 0, "abcde_commit_hash_fghij")
+
+    mocker.patch("ruff2bitbucket.git.run", new=local_run)
+
+
+def test_repo_info_picks_the_bitbucket_remote(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--bitbucket-url", "https://host"])
+    _remotes(
+        mocker,
+        origin="https://github.com/user/repo.git",
+        others="remote.origin.url https://github.com/user/repo.git\nremote.bb.url ssh://git@host:7999/~jdoe/repo.git\n",
+    )
+
+    sut = get_repo_info()
+
+    assert sut.repository_endpoint == "https://host/rest/api/latest/projects/~jdoe/repos/repo"
+    assert sut.commit_url == "https://host/users/jdoe/repos/repo/commits/abcde_commit_hash_fghij"
+
+
+def test_repo_info_prefers_http_over_a_github_ssh_origin(mocker: MockerFixture) -> None:
+    _remotes(
+        mocker,
+        origin="git@github.com:org/repo.git",
+        others="remote.origin.url git@github.com:org/repo.git\nremote.bb.url https://host/scm/abc/repo.git\n",
+    )
+
+    assert get_repo_info().repository_endpoint == "https://host/rest/api/latest/projects/abc/repos/repo"
+
+
+def test_repo_info_ssh_remote_on_the_bitbucket_host(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--bitbucket-url", "https://bitbucket.corp:8443/context"])
+    _remotes(
+        mocker,
+        origin="git@github.com:org/repo.git",
+        others=(
+            "remote.origin.url git@github.com:org/repo.git\nremote.bb.url ssh://git@bitbucket.corp:7999/abc/repo.git\n"
+        ),
+    )
+
+    assert get_repo_info().repository_endpoint == (
+        "https://bitbucket.corp:8443/context/rest/api/latest/projects/abc/repos/repo"
+    )
+
+
+def test_repo_info_github_ssh_origin_is_not_bitbucket(mocker: MockerFixture) -> None:
+    _remotes(mocker, origin="git@github.com:org/repo.git", others="remote.origin.url git@github.com:org/repo.git\n")
+
+    with pytest.raises(ValueError, match=r"Couldn't interpret 'git@github.com:org/repo.git'.*--bitbucket-url"):
+        get_repo_info()
+
+
+def test_repo_info_chosen_remote(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--remote", "bb", "--bitbucket-url", "https://host:8443/context/"])
+    _remotes(
+        mocker,
+        origin="https://other/scm/abc/repository.git",
+        others="remote.origin.url https://other/scm/abc/repository.git\nremote.bb.url git@host:def/repo.git\n",
+    )
+
+    sut = get_repo_info()
+
+    assert sut.repository_endpoint == "https://host:8443/context/rest/api/latest/projects/def/repos/repo"
+
+
+def test_repo_info_unknown_remote(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--remote", "upstream"])
+    _remotes(mocker, origin="", others="")
+
+    with pytest.raises(ValueError, match=r"There is no remote called 'upstream'"):
+        get_repo_info()
+
+
+def test_repo_info_without_origin(mocker: MockerFixture) -> None:
+    _remotes(mocker, origin="", others="")
+
+    with pytest.raises(ValueError, match=r"No git has been set up"):
+        get_repo_info()
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from ruff2bitbucket.arguments import get_arguments
+from ruff2bitbucket.cache import ResultCache, get_result_cache
+from ruff2bitbucket.common import CapturedLine
+
+
+def test_result_cache_roundtrip(tmp_path: Path) -> None:
+    sut = ResultCache(str(tmp_path / "cache" / "results.sqlite"), max_entries=10)
+    sut.put_many({"a": [CapturedLine("a.py", 1, 2, "F401 unused", "F401", 1, 5, fixable=True)], "b": []})
+
+    assert sut.get_many(["a", "b", "c"]) == {
+        "a": [CapturedLine("a.py", 1, 2, "F401 unused", "F401", 1, 5, fixable=True)],
+        "b": [],
+    }
+    assert len(sut) == 2
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = iter(range(100))
+    monkeypatch.setattr("time.time", lambda: next(now))
+
+    sut = ResultCache(str(tmp_path / "results.sqlite"), max_entries=2)
+    sut.put_many({"a": []})
+    sut.put_many({"b": []})
+    sut.get_many(["a"])  # 'a' is used more recently than 'b' now
+    sut.put_many({"c": []})
+
+    assert sorted(sut.get_many(["a", "b", "c"])) == ["a", "c"]
+    assert len(sut) == 2
+
+
+def test_get_result_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    assert get_result_cache() is None
+    get_arguments.cache_clear()
+    get_result_cache.cache_clear()
+
+    monkeypatch.setattr(sys, "argv", ["script", "--result-cache", str(tmp_path / "results.sqlite")])
+    assert isinstance(get_result_cache(), ResultCache)
+    assert get_result_cache() is get_result_cache()
@@ -1,7 +1,25 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, List, Sequence
+
 import pytest
 from pytest_mock import MockerFixture
 
-from ruff2bitbucket.capturer import check_code_mistakes, check_formatting, has_executable
+from ruff2bitbucket.cache import ResultCache
+from ruff2bitbucket.capturer import (
+    capture_concurrently,
+    check_code_mistakes,
+    check_formatting,
+    check_sharded,
+    check_with_cache,
+    has_executable,
+    only_changed_lines,
+    ruff_config_hash,
+    split_in_shards,
+    widens_include,
+)
 from ruff2bitbucket.common import CapturedLine
 
 
@@ -14,8 +32,46 @@ def test_has_executable(mocker: MockerFixture) -> None:
 
 def test_code_mistakes() -> None:
     assert list(check_code_mistakes()) == [
-        CapturedLine("src/some_repo/filter/fltr.py", 337, 21, "G004 Logging statement uses f-string"),
-        CapturedLine("src/some_repo/filter/wrk.py", 24, 66, "Q000 [*] Single quotes found but double quotes preferred"),
+        CapturedLine("src/some_repo/filter/fltr.py", 337, 21, "G004 Logging statement uses f-string", "G004", 337, 26),
+        CapturedLine(
+            "src/some_repo/filter/wrk.py",
+            24,
+            66,
+            "Q000 [*] Single quotes found but double quotes preferred",
+            "Q000",
+            24,
+            71,
+            fixable=True,
+        ),
+    ]
+
+
+def test_code_mistakes_syntax_error(mocker: MockerFixture) -> None:
+    output = json.dumps(
+        {
+            "code": None,
+            "end_location": {"column": 1, "row": 3},
+            "filename": os.path.join(os.getcwd(), "broken.py"),
+            "fix": None,
+            "location": {"column": 1, "row": 2},
+            "message": "SyntaxError: Expected an expression",
+        }
+    )
+    mocker.patch("ruff2bitbucket.capturer.stream", return_value=iter(output.splitlines(keepends=True)))
+
+    assert list(check_code_mistakes()) == [
+        CapturedLine("broken.py", 2, 1, "SyntaxError: Expected an expression", end_line=3, end_column=1),
+    ]
+
+
+def test_code_mistakes_unparsable_output(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
+    output = 'warning: something odd happened\n\n{"no": "filename"}\n'
+    mocker.patch("ruff2bitbucket.capturer.stream", return_value=iter(output.splitlines(keepends=True)))
+
+    assert list(check_code_mistakes()) == []
+    assert [rec.message for rec in caplog.records if rec.levelname == "WARNING"] == [
+        "Couldn't interpret ruff's output: warning: something odd happened",
+        'Couldn\'t interpret ruff\'s output: {"no": "filename"}',
     ]
 
 
@@ -42,3 +98,204 @@ def test_check_formatting_no_ruff(mocker: MockerFixture, caplog: pytest.LogCaptu
         rec.levelname == "WARNING" and "No format check is done because ruff is not available" in rec.message
         for rec in caplog.records
     )
+
+
+def test_capture_concurrently_keeps_the_order() -> None:
+    assert list(capture_concurrently(check_code_mistakes, check_formatting)) == [
+        *check_code_mistakes(),
+        *check_formatting(),
+    ]
+
+
+def test_capture_concurrently_runs_at_the_same_time() -> None:
+    barrier = threading.Barrier(2, timeout=5)
+
+    def first() -> Iterable[CapturedLine]:
+        barrier.wait()  # Would time out if the second one isn't started yet
+        yield CapturedLine("a")
+
+    def second() -> Iterable[CapturedLine]:
+        barrier.wait()
+        yield CapturedLine("b")
+
+    assert list(capture_concurrently(first, second)) == [CapturedLine("a"), CapturedLine("b")]
+
+
+def test_capture_concurrently_reraises() -> None:
+    def broken() -> Iterable[CapturedLine]:
+        yield CapturedLine("a")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        list(capture_concurrently(broken, check_formatting))
+
+
+def test_checks_on_specific_paths(mocker: MockerFixture) -> None:
+    stream_mock = mocker.patch("ruff2bitbucket.capturer.stream", return_value=iter([]))
+
+    assert list(check_code_mistakes(["a.py", "b.py"])) == []
+    assert stream_mock.call_args.args[-2:] == ("a.py", "b.py")
+
+    assert list(check_formatting(["a.py", "b.py"])) == []
+    assert stream_mock.call_args.args[-2:] == ("a.py", "b.py")
+
+
+def test_checks_without_paths(mocker: MockerFixture) -> None:
+    stream_mock = mocker.patch("ruff2bitbucket.capturer.stream")
+
+    assert list(check_code_mistakes([])) == []
+    assert list(check_formatting([])) == []
+    stream_mock.assert_not_called()
+
+
+def test_only_changed_lines() -> None:
+    captured_lines = [
+        CapturedLine("a.py", 1),
+        CapturedLine("a.py", 5),
+        CapturedLine("a.py", 9),
+        CapturedLine("a.py", 0, description="Would reformat"),
+        CapturedLine("b.py", 5),
+    ]
+
+    assert list(only_changed_lines(captured_lines, {"a.py": [(4, 6), (9, 9)]})) == [
+        CapturedLine("a.py", 5),
+        CapturedLine("a.py", 9),
+        CapturedLine("a.py", 0, description="Would reformat"),
+    ]
+
+
+@pytest.fixture
+def result_cache(tmp_path: Path, mocker: MockerFixture) -> ResultCache:
+    mocker.patch("ruff2bitbucket.capturer.get_ruff_version", return_value="ruff 1.2.3")
+    mocker.patch("ruff2bitbucket.capturer.ruff_config_hash", return_value="config")
+    mocker.patch("ruff2bitbucket.capturer.widens_include", return_value=False)
+    mocker.patch(
+        "ruff2bitbucket.capturer.get_file_hashes",
+        return_value={"a.py": "blob_a", "b.py": "blob_b", "c.py": None, "pyproject.toml": "blob_cfg"},
+    )
+    return ResultCache(str(tmp_path / "results.sqlite"), max_entries=100)
+
+
+def test_check_with_cache(result_cache: ResultCache) -> None:
+    calls: List[Sequence[str]] = []
+
+    def check(paths: Sequence[str]) -> Iterable[CapturedLine]:
+        calls.append(paths)
+        findings = {"a.py": [CapturedLine("a.py", 1)], "c.py": [CapturedLine("c.py", 3)]}
+        for path in ["a.py", "b.py", "c.py"] if paths == ["."] else paths:
+            yield from findings.get(path, [])
+
+    expected = [CapturedLine("a.py", 1), CapturedLine("c.py", 3)]
+
+    assert list(check_with_cache(check, "check", ["."], result_cache)) == expected
+    assert calls == [["."]]  # A cold cache is filled in one go
+    assert len(result_cache) == 2  # c.py isn't committed, so can't be cached
+
+    calls.clear()
+    assert list(check_with_cache(check, "check", ["."], result_cache)) == expected
+    assert calls == [["c.py"]]
+
+    calls.clear()
+    assert list(check_with_cache(check, "format", ["b.py"], result_cache)) == []
+    assert calls == [["b.py"]]  # Other tool, so not cached yet
+
+
+def test_check_with_cache_no_ruff(result_cache: ResultCache, mocker: MockerFixture) -> None:
+    mocker.patch("shutil.which", return_value=None)
+
+    assert list(check_with_cache(check_code_mistakes, "check", ["."], result_cache)) == []
+    assert len(result_cache) == 0
+
+
+def test_ruff_config_hash(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "pyproject.toml").write_text("[tool.ruff]\n")
+    (tmp_path / "ruff.toml").write_text("line-length = 100\n")
+    monkeypatch.chdir(tmp_path / "sub")
+
+    before = ruff_config_hash(["pyproject.toml", "a.py"])
+    assert before == ruff_config_hash(["pyproject.toml", "a.py", "b.py"])
+
+    (tmp_path / "ruff.toml").write_text("line-length = 120\n")
+    assert before != ruff_config_hash(["pyproject.toml", "a.py"])
+
+
+@pytest.mark.parametrize(
+    ("filename", "content", "expected"),
+    [
+        ("pyproject.toml", "[tool.ruff]\nline-length = 100\n", False),
+        ("pyproject.toml", "[tool.ruff]\nextend-include = ['*.ipynb']\n", True),
+        ("pyproject.toml", "[tool.ruff.lint]\ninclude = ['*.pyi']\n", False),
+        ("pyproject.toml", "[tool.poetry]\ninclude = ['data']\n", False),
+        ("ruff.toml", "include = ['*.py', 'scripts/*']\n", True),
+        (".ruff.toml", "[lint]\ninclude = ['*.pyi']\n", False),
+    ],
+)
+def test_widens_include(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, filename: str, content: str, expected: bool
+) -> None:
+    (tmp_path / filename).write_text(content)
+    monkeypatch.chdir(tmp_path)
+
+    assert widens_include([filename, "missing.toml"]) is expected
+
+
+def test_split_in_shards(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    for name, size in {"a.py": 50, "b.py": 10, "c.py": 10, "d.py": 30, "e.py": 20, "f.py": 30}.items():
+        (tmp_path / name).write_text("x" * size)
+
+    assert split_in_shards(["f.py", "e.py", "d.py", "c.py", "b.py", "a.py"], 3) == [
+        ["a.py"],
+        ["b.py", "c.py", "d.py"],
+        ["e.py", "f.py"],
+    ]
+    assert split_in_shards(["b.py", "a.py", "gone.py"], 1) == [["a.py", "b.py", "gone.py"]]
+    assert split_in_shards(["b.py", "a.py"], 5) == [["a.py"], ["b.py"]]
+
+
+def test_check_sharded(mocker: MockerFixture) -> None:
+    mocker.patch(
+        "ruff2bitbucket.capturer.get_file_hashes",
+        return_value={"d.py": "blob_d", "a.py": "blob_a", "c.py": None, "b.py": "blob_b", "README.md": "blob_readme"},
+    )
+    mocker.patch("ruff2bitbucket.capturer.widens_include", return_value=False)
+    mocker.patch("ruff2bitbucket.capturer._file_size", return_value=1)
+    calls: List[Sequence[str]] = []
+
+    def check(paths: Sequence[str]) -> Iterable[CapturedLine]:
+        calls.append(paths)
+        for path in paths:
+            yield CapturedLine(path, 1)
+
+    assert list(check_sharded(check, 2, ["."])) == [CapturedLine(name, 1) for name in ("a.py", "b.py", "c.py", "d.py")]
+    assert sorted(calls) == [["a.py", "b.py"], ["c.py", "d.py"]]
+
+    calls.clear()
+    assert list(check_sharded(check, 1, ["."])) == [CapturedLine(".", 1)]
+    assert calls == [["."]]  # One shard is just a normal run
+
+
+def test_check_sharded_in_batches(mocker: MockerFixture) -> None:
+    files = [f"{idx:04}.py" for idx in range(2_500)]
+    mocker.patch("ruff2bitbucket.capturer.get_file_hashes", return_value=dict.fromkeys(files, "blob"))
+    mocker.patch("ruff2bitbucket.capturer.widens_include", return_value=False)
+    mocker.patch("ruff2bitbucket.capturer._file_size", return_value=1)
+    calls: List[Sequence[str]] = []
+
+    def check(paths: Sequence[str]) -> Iterable[CapturedLine]:
+        calls.append(paths)
+        for path in paths:
+            yield CapturedLine(path, 1)
+
+    assert list(check_sharded(check, 2, ["."])) == [CapturedLine(name, 1) for name in files]
+    assert sorted(len(paths) for paths in calls) == [250, 250, 1_000, 1_000]
+
+
+def test_check_sharded_when_ruff_includes_more(mocker: MockerFixture) -> None:
+    mocker.patch("ruff2bitbucket.capturer.get_file_hashes", return_value={"a.py": "blob_a", "b.ipynb": "blob_b"})
+    mocker.patch("ruff2bitbucket.capturer.widens_include", return_value=True)
+    check = mocker.Mock(return_value=[CapturedLine("b.ipynb", 1)])
+
+    assert list(check_sharded(check, 2, ["."])) == [CapturedLine("b.ipynb", 1)]
+    check.assert_called_once_with(["."])  # Only ruff knows which files it checks
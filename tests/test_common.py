@@ -1,24 +1,63 @@
+import os
 import subprocess
+import sys
+import time
+from pathlib import Path
 
 from pytest_mock import MockerFixture
 from pytest_mock.plugin import MockType
 
-from ruff2bitbucket.common import CapturedLine, run
+from ruff2bitbucket.common import CapturedLine, batched, current_directory, in_directory, per_directory, run, stream
 
 
 def test_run(mocker: MockerFixture) -> None:
     run_mock: MockType = mocker.patch("subprocess.run", return_value="abc")
 
     assert run("a", "b", check=True) == "abc"
-    run_mock.assert_called_once_with(("a", "b"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    run_mock.assert_called_once_with(
+        ("a", "b"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True, cwd=None
+    )
 
     run_mock.reset_mock()
     assert run("a", "b", check=False) == "abc"
-    run_mock.assert_called_once_with(("a", "b"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False)
+    run_mock.assert_called_once_with(
+        ("a", "b"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=False, cwd=None
+    )
+
+
+def test_run_in_directory(mocker: MockerFixture, tmp_path: Path) -> None:
+    run_mock: MockType = mocker.patch("subprocess.run")
+
+    with in_directory(str(tmp_path)):
+        assert current_directory() == str(tmp_path)
+        run("a", check=True)
+
+    assert current_directory() == os.getcwd()
+    assert run_mock.call_args.kwargs["cwd"] == str(tmp_path)
+
+
+def test_per_directory(tmp_path: Path) -> None:
+    calls = []
+
+    @per_directory
+    def where() -> str:
+        calls.append(current_directory())
+        return current_directory()
+
+    assert where() == os.getcwd()
+    with in_directory(str(tmp_path)):
+        assert where() == str(tmp_path)
+        assert where() == str(tmp_path)
+    assert where() == os.getcwd()
+    assert calls == [os.getcwd(), str(tmp_path)]
+
+    where.cache_clear()
+    where()
+    assert len(calls) == 3
 
 
 def test_captured_line_happy_flow() -> None:
-    sut = CapturedLine("  file  ", "1", "2", "  desc  ")
+    sut = CapturedLine.parse("  file  ", "1", "2", "  desc  ")
 
     assert sut.filename == "file"
     assert sut.line == 1
@@ -26,10 +65,47 @@ def test_captured_line_happy_flow() -> None:
     assert sut.description == "  desc"
 
 
+def test_captured_line_is_compact() -> None:
+    first = CapturedLine.parse("".join(["some/", "file.py"]), code="".join(["F", "401"]))
+    second = CapturedLine.parse("".join(["some/", "file.py "]), code="".join(["F4", "01"]))
+
+    assert not hasattr(first, "__dict__")
+    assert first.filename is second.filename
+    assert first.code is second.code
+
+
 def test_captured_line_default() -> None:
-    sut = CapturedLine("  file  ")
+    sut = CapturedLine.parse("  file  ")
 
     assert sut.filename == "file"
     assert sut.line == 0
     assert sut.column == 0
     assert sut.description == ""
+
+
+def test_captured_line_extra_fields() -> None:
+    sut = CapturedLine.parse("file", 1, 2, "F401 [*] unused", code="F401", end_line="3", end_column="4", fixable=True)
+
+    assert sut.code == "F401"
+    assert sut.end_line == 3
+    assert sut.end_column == 4
+    assert sut.fixable
+
+
+def test_stream() -> None:
+    assert list(stream(sys.executable, "-c", "print('a'); print('b')")) == ["a\n", "b\n"]
+
+
+def test_stream_yields_before_the_command_finishes() -> None:
+    start = time.monotonic()
+
+    sut = stream(sys.executable, "-c", "import time; print('a', flush=True); time.sleep(30)")
+    assert next(sut) == "a\n"
+    sut.close()  # Kills the command instead of waiting for it
+
+    assert time.monotonic() - start < 20
+
+
+def test_batched() -> None:
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
@@ -76,7 +76,7 @@ def test_creds_get_stored(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch
     monkeypatch.setenv("CRED_USER", "USER")
     monkeypatch.setenv("CRED_PASSWORD", "PASS")
 
-    put_mock = mocker.patch("requests.put")
+    put_mock = mocker.patch("requests.Session.request")
     put_mock.return_value = mocker.Mock(status_code=200)
     assert get_credentials()._correct_combination is None
     main()
@@ -0,0 +1,114 @@
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket import main
+from ruff2bitbucket.credentials import CredentialCache, UserPass, get_credentials
+
+
+@pytest.fixture
+def cache_file(tmp_path: Path) -> Path:
+    return tmp_path / "cache" / "credential.json"
+
+
+def test_cache_roundtrip(cache_file: Path) -> None:
+    sut = CredentialCache(str(cache_file), ttl=60)
+    sut.store(UserPass("USER2", "PASS2"))
+
+    assert "PASS2" not in cache_file.read_text()
+    assert sut.find([UserPass("USER1", "PASS1"), UserPass("USER2", "PASS2")]) == UserPass("USER2", "PASS2")
+    assert sut.find([UserPass("USER2", "OTHER")]) is None
+
+
+def test_cache_expired(cache_file: Path) -> None:
+    sut = CredentialCache(str(cache_file), ttl=60)
+    sut.store(UserPass("USER", "PASS"))
+
+    content = json.loads(cache_file.read_text())
+    content["timestamp"] = time.time() - 61
+    cache_file.write_text(json.dumps(content))
+
+    assert sut.find([UserPass("USER", "PASS")]) is None
+
+
+@pytest.mark.parametrize("content", [None, "", "not json", "{}", '{"timestamp": 0, "salt": "xyz"}'])
+def test_cache_missing_or_corrupt(cache_file: Path, content: str) -> None:
+    if content is not None:
+        cache_file.parent.mkdir()
+        cache_file.write_text(content)
+
+    assert CredentialCache(str(cache_file), ttl=1e12).find([UserPass("USER", "PASS")]) is None
+
+
+def test_cache_not_writable(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    (tmp_path / "file").write_text("")
+
+    CredentialCache(str(tmp_path / "file" / "credential.json"), ttl=60).store(UserPass("USER", "PASS"))
+
+    warnings = [rec for rec in caplog.records if rec.levelno >= logging.WARNING]
+    assert warnings[0].levelname == "WARNING"
+    assert warnings[0].message.startswith("Couldn't write the credential cache")
+
+
+def test_cached_combination_comes_first(monkeypatch: pytest.MonkeyPatch, cache_file: Path) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--credential-cache", str(cache_file)])
+    monkeypatch.setenv("CREDUSR", "USER1")
+    monkeypatch.setenv("CREDPWD", "PASS1")
+    monkeypatch.setenv("OTHUSER", "USER2")
+    monkeypatch.setenv("OTHPASSWORD", "PASS2")
+
+    assert get_credentials().cached_combination() is None
+    assert list(get_credentials()) == [UserPass("USER1", "PASS1"), UserPass("USER2", "PASS2")]
+
+    CredentialCache(str(cache_file), ttl=60).store(UserPass("USER2", "PASS2"))
+    get_credentials.cache_clear()  # The next run
+
+    assert get_credentials().cached_combination() == UserPass("USER2", "PASS2")
+    assert list(get_credentials()) == [UserPass("USER2", "PASS2"), UserPass("USER1", "PASS1")]
+
+
+def test_main_uses_the_cache(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, cache_file: Path) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--credential-cache", str(cache_file)])
+    monkeypatch.setenv("CREDUSR", "USER1")
+    monkeypatch.setenv("CREDPWD", "PASS1")
+    monkeypatch.setenv("OTHUSER", "USER2")
+    monkeypatch.setenv("OTHPASSWORD", "PASS2")
+    CredentialCache(str(cache_file), ttl=60).store(UserPass("USER2", "PASS2"))
+    before = json.loads(cache_file.read_text())
+
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=200)
+
+    main()
+
+    assert [(call.args[0], call.kwargs["auth"]) for call in request_mock.call_args_list] == [
+        ("PUT", ("USER2", "PASS2")),
+        ("POST", ("USER2", "PASS2")),
+    ]
+    assert json.loads(cache_file.read_text()) == before  # Not written again when it still has the right one
+
+
+def test_the_cache_is_only_searched_once(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, cache_file: Path
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--credential-cache", str(cache_file)])
+    monkeypatch.setenv("CREDUSR", "USER1")
+    monkeypatch.setenv("CREDPWD", "PASS1")
+    monkeypatch.setenv("OTHUSER", "USER2")
+    monkeypatch.setenv("OTHPASSWORD", "PASS2")
+    CredentialCache(str(cache_file), ttl=60).store(UserPass("USER2", "PASS2"))
+    find_spy = mocker.spy(CredentialCache, "find")
+    store_spy = mocker.spy(CredentialCache, "store")
+
+    credentials = get_credentials()
+    assert credentials.cached_combination() == UserPass("USER2", "PASS2")
+    assert list(credentials) == [UserPass("USER2", "PASS2"), UserPass("USER1", "PASS1")]
+    credentials.report_correct_combination(UserPass("USER2", "PASS2"))
+
+    assert find_spy.call_count == 1
+    store_spy.assert_not_called()
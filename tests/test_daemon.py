@@ -0,0 +1,120 @@
+import logging
+import os
+import socket
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket import client, main
+from ruff2bitbucket.__main__ import upload_target
+from ruff2bitbucket.common import current_directory
+from ruff2bitbucket.daemon import JobServer, _remove_stale_socket
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="No unix sockets")
+
+logger = logging.getLogger("ruff2bitbucket.test")
+
+
+@pytest.fixture
+def jobs(tmp_path: Path) -> Iterator[List[tuple]]:
+    """A daemon on `tmp_path / "socket"`. Collects (target, directory) of the jobs it ran."""
+    received = []
+
+    def run_job(target: str) -> bool:
+        received.append((target, current_directory()))
+        logger.warning("Checking %s", target)
+        return target != "unknown_commit"
+
+    server = JobServer(str(tmp_path / "socket"), run_job, workers=2)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01})
+    thread.start()
+    try:
+        yield received
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_daemon_runs_jobs(jobs: List[tuple], tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    assert client.submit(str(tmp_path / "socket"), str(tmp_path)) == 0
+    assert client.submit(str(tmp_path / "socket"), str(tmp_path), "unknown_commit") == 1
+
+    assert jobs == [(str(tmp_path), str(tmp_path)), ("unknown_commit", str(tmp_path))]
+    assert capsys.readouterr().err.splitlines() == [
+        f"WARNING:ruff2bitbucket.test:Checking {tmp_path}",
+        "WARNING:ruff2bitbucket.test:Checking unknown_commit",
+    ]
+    assert oct(os.stat(tmp_path / "socket").st_mode & 0o777) == oct(0o600)
+
+
+def test_daemon_refuses_invalid_jobs(jobs: List[tuple], tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    assert client.submit(str(tmp_path / "socket"), "relative/path") == 2
+    assert not jobs
+    assert capsys.readouterr().err == "'relative/path' isn't a directory.\n"
+
+
+def test_no_daemon(tmp_path: Path) -> None:
+    assert client.submit(str(tmp_path / "socket"), str(tmp_path)) is None
+
+
+def test_client_uses_the_daemon(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(os.environ, client.socket_variable, "/run/ruff2bitbucket.socket")
+    submit_mock = mocker.patch("ruff2bitbucket.client.submit", return_value=1)
+    main_mock = mocker.patch("ruff2bitbucket.__main__.main")
+
+    with pytest.raises(SystemExit) as ex:
+        client.main()
+
+    assert ex.value.code == 1
+    submit_mock.assert_called_once_with("/run/ruff2bitbucket.socket", os.getcwd())
+    main_mock.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    ("socket_path", "argv", "daemon_running"),
+    [
+        (None, ["script"], True),
+        ("/run/ruff2bitbucket.socket", ["script"], False),
+        ("/run/ruff2bitbucket.socket", ["script", "--diff-base", "origin/master"], True),
+    ],
+)
+def test_client_runs_in_process(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, socket_path: str, argv: List[str], daemon_running: bool
+) -> None:
+    if socket_path:
+        monkeypatch.setitem(os.environ, client.socket_variable, socket_path)
+    monkeypatch.setattr(sys, "argv", argv)
+    submit_mock = mocker.patch("ruff2bitbucket.client.submit", return_value=0 if daemon_running else None)
+    main_mock = mocker.patch("ruff2bitbucket.__main__.main")
+
+    client.main()
+
+    main_mock.assert_called_once_with()
+    assert submit_mock.called == (socket_path is not None and len(argv) == 1)
+
+
+def test_remove_stale_socket(jobs: List[tuple], tmp_path: Path) -> None:  # noqa: ARG001
+    with pytest.raises(ValueError, match="Another daemon is listening"):
+        _remove_stale_socket(str(tmp_path / "socket"))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(str(tmp_path / "stale"))  # Nobody listens on it anymore
+    _remove_stale_socket(str(tmp_path / "stale"))
+
+    assert not (tmp_path / "stale").exists()
+
+
+def test_main_daemon(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(os.environ, "CRED_USER", "USER")
+    monkeypatch.setitem(os.environ, "CRED_PASSWORD", "PASS")
+    monkeypatch.setattr(sys, "argv", ["script", "--daemon", "/run/ruff2bitbucket.socket"])
+    serve_mock = mocker.patch("ruff2bitbucket.daemon.serve")
+
+    main()
+
+    serve_mock.assert_called_once_with("/run/ruff2bitbucket.socket", upload_target)
@@ -1,11 +1,20 @@
 # Not much to test in here...
+import os
+from pathlib import Path
 from subprocess import CompletedProcess
 
 import pytest
 from pytest_mock import MockerFixture
 from pytest_mock.plugin import MockType
 
-from ruff2bitbucket.git import get_current_git_commit_hash, get_current_repo_uri
+from ruff2bitbucket.git import (
+    checkout,
+    get_changed_files,
+    get_changed_lines,
+    get_current_git_commit_hash,
+    get_current_repo_uri,
+    get_remote_urls,
+)
 
 
 @pytest.fixture
@@ -31,3 +40,100 @@ def test_get_current_repo_uri(mock_run: MockType) -> None:
 
     assert get_current_repo_uri() == "abc"
     mock_run.assert_not_called()
+
+
+def test_get_changed_files(mock_run: MockType) -> None:
+    mock_run.return_value = CompletedProcess("", 0, "src/a.py\nREADME.md\nsrc/b.pyi\nnotebook.ipynb\n")
+
+    assert get_changed_files("origin/master") == ["src/a.py", "src/b.pyi", "notebook.ipynb"]
+    mock_run.assert_called_once_with(
+        "git",
+        "-c",
+        "core.quotePath=off",
+        "diff",
+        "--relative",
+        "--name-only",
+        "--diff-filter=d",
+        "origin/master...HEAD",
+        check=True,
+    )
+
+
+def test_get_changed_lines(mock_run: MockType) -> None:
+    mock_run.return_value = CompletedProcess(
+        "",
+        0,
+        (
+            "diff --git a/src/a.py b/src/a.py\n"
+            "index 1234567..89abcde 100644\n"
+            "--- a/src/a.py\n"
+            "+++ b/src/a.py\n"
+            "@@ -3 +3 @@ def f():\n"
+            "-    return 1\n"
+            "+    return 2\n"
+            "@@ -10,2 +10,0 @@ def g():\n"
+            "-    pass\n"
+            "-    pass\n"
+            "@@ -20,0 +21,3 @@ def h():\n"
+            "+    a = 1\n"
+            "+    b = 2\n"
+            "+    c = 3\n"
+            "diff --git a/src/gone.py b/src/gone.py\n"
+            "--- a/src/gone.py\n"
+            "+++ /dev/null\n"
+            "@@ -1,2 +0,0 @@\n"
+            "-import os\n"
+            "-import sys\n"
+        ),
+    )
+
+    assert get_changed_lines("origin/master") == {"src/a.py": [(3, 3), (21, 23)]}
+    assert mock_run.call_args.args[-1] == "origin/master...HEAD"
+    assert "--unified=0" in mock_run.call_args.args
+
+
+def test_get_changed_lines_of_a_filename_with_a_space(mock_run: MockType) -> None:
+    mock_run.return_value = CompletedProcess(
+        "",
+        0,
+        "diff --git a/src/a b.py b/src/a b.py\n--- a/src/a b.py\t\n+++ b/src/a b.py\t\n@@ -3 +3 @@\n-x = 1\n+x = 2\n",
+    )
+
+    assert get_changed_lines("origin/master") == {"src/a b.py": [(3, 3)]}
+
+
+def test_checkout_a_repository(mock_run: MockType, tmp_path: Path) -> None:
+    with checkout(str(tmp_path)) as directory:
+        assert directory == str(tmp_path)
+
+    mock_run.assert_not_called()
+
+
+def test_checkout_a_commit(mock_run: MockType) -> None:
+    with checkout("1234abcd") as directory:
+        assert os.path.isdir(directory)
+
+    assert [call.args for call in mock_run.call_args_list] == [
+        ("git", "worktree", "add", "--detach", directory, "1234abcd"),
+        ("git", "worktree", "remove", "--force", directory),
+    ]
+
+
+def test_read_from_the_git_directory(mock_run: MockType, mocker: MockerFixture) -> None:
+    git_dir = mocker.patch("ruff2bitbucket.git.find_git_directory").return_value
+    git_dir.head.return_value = "1" * 40
+    git_dir.config.return_value = "ssh://git@localhost:7999/abc/repository.git"
+
+    assert get_current_git_commit_hash() == "1" * 40
+    assert get_current_repo_uri() == "ssh://git@localhost:7999/abc/repository.git"
+    git_dir.config.assert_called_once_with("remote.origin.url")
+    mock_run.assert_not_called()
+
+
+def test_get_remote_urls(mock_run: MockType) -> None:
+    mock_run.return_value = CompletedProcess(
+        "", 0, "remote.origin.url https://host/scm/abc/repo.git\nremote.my.fork.url git@host:~me/repo.git\n"
+    )
+
+    assert get_remote_urls() == {"origin": "https://host/scm/abc/repo.git", "my.fork": "git@host:~me/repo.git"}
+    mock_run.assert_called_once_with("git", "config", "--get-regexp", r"^remote\..*\.url$", check=False)
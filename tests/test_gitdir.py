@@ -0,0 +1,157 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket.gitdir import Unsupported, find_git_directory, parse_config
+
+commit1 = "1" * 40
+commit2 = "2" * 40
+git_environment = {"PATH": os.environ.get("PATH", os.defpath)}  # The tests themselves run without an environment
+
+
+@pytest.fixture
+def repository(tmp_path: Path) -> Path:
+    git_dir = tmp_path / ".git"
+    (git_dir / "refs" / "heads").mkdir(parents=True)
+    (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+    (git_dir / "refs" / "heads" / "main").write_text(commit1 + "\n")
+    (git_dir / "config").write_text(
+        "[core]\n"
+        "\tbare = false\n"
+        '[remote "origin"]\n'
+        "\turl = https://localhost/scm/abc/repository.git  ; the first one\n"
+        '\tfetch = "+refs/heads/*:refs/remotes/origin/*"\n'
+        '[remote "Upstream"]\n'
+        '\turl = "ssh://git@localhost:7999/abc/repo\\"sitory.git"\n'
+    )
+    return tmp_path
+
+
+def test_head_on_a_branch(repository: Path) -> None:
+    (repository / "src").mkdir()
+
+    git_dir = find_git_directory(str(repository / "src"))
+
+    assert git_dir.path == str(repository / ".git")
+    assert git_dir.common == git_dir.path
+    assert git_dir.head() == commit1
+
+
+def test_head_from_packed_refs(repository: Path) -> None:
+    (repository / ".git" / "HEAD").write_text("ref: refs/heads/feature/x\n")
+    (repository / ".git" / "packed-refs").write_text(
+        "# pack-refs with: peeled fully-peeled sorted\n"
+        f"{commit1} refs/tags/v1\n"
+        f"^{commit1}\n"
+        f"{commit2} refs/heads/feature/x\n"
+    )
+
+    assert find_git_directory(str(repository)).head() == commit2
+
+
+def test_head_detached(repository: Path) -> None:
+    (repository / ".git" / "HEAD").write_text(commit2 + "\n")
+
+    assert find_git_directory(str(repository)).head() == commit2
+
+
+def test_head_unknown(repository: Path) -> None:
+    (repository / ".git" / "HEAD").write_text("ref: refs/heads/unborn\n")
+
+    with pytest.raises(Unsupported, match="Unknown ref 'refs/heads/unborn'"):
+        find_git_directory(str(repository)).head()
+
+
+def test_linked_worktree(repository: Path, tmp_path: Path) -> None:
+    worktree_git_dir = repository / ".git" / "worktrees" / "other"
+    worktree_git_dir.mkdir(parents=True)
+    (worktree_git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+    (worktree_git_dir / "commondir").write_text("../..\n")
+    worktree = tmp_path / "other"
+    worktree.mkdir()
+    (worktree / ".git").write_text(f"gitdir: {worktree_git_dir}\n")
+
+    git_dir = find_git_directory(str(worktree))
+
+    assert git_dir.path == str(worktree_git_dir)
+    assert git_dir.common == str(repository / ".git")
+    assert git_dir.head() == commit1
+    assert git_dir.config("remote.origin.url") == "https://localhost/scm/abc/repository.git"
+
+
+def test_config(repository: Path) -> None:
+    git_dir = find_git_directory(str(repository))
+
+    assert git_dir.config("core.bare") == "false"
+    assert git_dir.config("Remote.origin.URL") == "https://localhost/scm/abc/repository.git"
+    assert git_dir.config("remote.Upstream.url") == 'ssh://git@localhost:7999/abc/repo"sitory.git'
+    assert git_dir.config("remote.origin.fetch") == "+refs/heads/*:refs/remotes/origin/*"
+    assert git_dir.config("remote.upstream.url") is None  # Subsections are case sensitive
+    assert git_dir.remote_urls() == {
+        "origin": "https://localhost/scm/abc/repository.git",
+        "Upstream": 'ssh://git@localhost:7999/abc/repo"sitory.git',
+    }
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        "[include]\n\tpath = other.config\n",
+        '[includeIf "gitdir:~/work/"]\n\tpath = work.config\n',
+        "[core]\n\tsshCommand = ssh \\\n\t\t-v\n",
+        "url = outside/of/a/section\n",
+    ],
+)
+def test_config_unsupported(config: str) -> None:
+    with pytest.raises(Unsupported):
+        parse_config(config)
+
+
+def test_reftable_unsupported(repository: Path) -> None:
+    (repository / ".git" / "config").write_text("[extensions]\n\trefStorage = reftable\n")
+
+    with pytest.raises(Unsupported, match="aren't stored in files"):
+        find_git_directory(str(repository)).head()
+
+
+def test_no_repository(tmp_path: Path, mocker: MockerFixture) -> None:
+    mocker.patch("os.path.isdir", return_value=False)
+
+    with pytest.raises(Unsupported, match="isn't inside a git repository"):
+        find_git_directory(str(tmp_path))
+
+
+def test_steered_by_the_environment(repository: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setitem(os.environ, "GIT_DIR", str(repository / ".git"))
+
+    with pytest.raises(Unsupported):
+        find_git_directory(str(repository))
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git isn't installed")
+def test_same_as_git(tmp_path: Path) -> None:
+    def git(*args: str, cwd: Path = tmp_path) -> str:
+        return subprocess.run(
+            ["git", "-c", "user.name=me", "-c", "user.email=me@localhost", *args],
+            cwd=cwd,
+            env=git_environment,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    git("init", "--quiet")
+    git("remote", "add", "origin", "ssh://git@localhost:7999/abc/repository.git")
+    git("commit", "--quiet", "--allow-empty", "-m", "first")
+    git("pack-refs", "--all")
+    git("commit", "--quiet", "--allow-empty", "-m", "second")
+    git("worktree", "add", "--quiet", "--detach", str(tmp_path / "worktree"), "HEAD~1")
+
+    for directory in (tmp_path, tmp_path / "worktree"):
+        git_dir = find_git_directory(str(directory))
+        assert git_dir.head() == git("rev-parse", "HEAD", cwd=directory)
+        assert git_dir.config("remote.origin.url") == git("config", "--get", "remote.origin.url", cwd=directory)
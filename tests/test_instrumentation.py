@@ -0,0 +1,106 @@
+import json
+import pstats
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket import instrumentation, main
+from ruff2bitbucket.common import stream
+from ruff2bitbucket.instrumentation import counted, get_statistics, in_current_stage, record, stage
+
+
+@pytest.fixture(autouse=True)
+def _reset_instrumentation() -> Iterator[None]:
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+def test_stage_records_wall_time_and_counters() -> None:
+    with stage("first"):
+        record(requests=1, bytes_sent=10)
+        record(requests=1, bytes_received=20)
+    with stage("first"):
+        pass
+    record(findings=3)  # Outside of any stage
+
+    statistics = get_statistics()
+    assert statistics["first"].calls == 2
+    assert statistics["first"].wall_seconds > 0
+    assert statistics["first"].requests == 2
+    assert statistics["first"].bytes_sent == 10
+    assert statistics["first"].bytes_received == 20
+    assert statistics["other"].findings == 3
+
+
+def test_in_current_stage_crosses_threads() -> None:
+    with stage("threaded"):
+        thread = threading.Thread(target=in_current_stage(record), kwargs={"requests": 1})
+        thread.start()
+        thread.join()
+
+    assert get_statistics()["threaded"].requests == 1
+
+
+def test_counted() -> None:
+    sut = counted("numbers", lambda: iter([1, 2, 3]))
+
+    assert list(sut()) == [1, 2, 3]
+    assert get_statistics()["numbers"].findings == 3
+    assert get_statistics()["numbers"].calls == 1
+
+
+def test_subprocess_time_is_recorded() -> None:
+    with stage("child"):
+        list(stream(sys.executable, "-c", "print(1)"))
+
+    assert get_statistics()["child"].subprocess_seconds > 0
+
+
+def test_summary() -> None:
+    with stage("some stage"):
+        record(findings=1_234)
+
+    lines = instrumentation.summary().splitlines()
+    assert lines[0].split()[:3] == ["stage", "calls", "wall"]
+    assert lines[2].startswith("some stage")
+    assert lines[2].endswith("1,234")
+
+
+def test_main_writes_timings_trace_and_profile(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, tmp_path: Path, capsys: pytest.CaptureFixture
+) -> None:
+    monkeypatch.setenv("CRED_USER", "USER")
+    monkeypatch.setenv("CRED_PASSWORD", "PASS")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["script", "--timings", "--trace", str(tmp_path / "trace.json"), "--profile", str(tmp_path / "profile")],
+    )
+    mocker.patch("requests.Session.request").return_value = mocker.Mock(status_code=200, content=b"{}")
+
+    main()
+
+    assert "upload annotations" in capsys.readouterr().err
+
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    assert set(trace["stages"]) == {
+        "total",
+        "credentials",
+        "capture",
+        "ruff check",
+        "ruff format",
+        "git",
+        "upload report",
+        "upload annotations",
+    }
+    assert trace["stages"]["ruff check"]["findings"] == 2
+    assert trace["stages"]["upload report"]["requests"] == 1
+    assert trace["stages"]["upload report"]["bytes_received"] == 2
+    assert {event["stage"] for event in trace["events"]} == set(trace["stages"])
+
+    assert pstats.Stats(str(tmp_path / "profile")).total_calls > 0
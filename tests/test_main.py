@@ -1,9 +1,22 @@
+import json
 import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
 
 import pytest
+import requests
 from pytest_mock import MockerFixture
 
+import ruff2bitbucket.capturer
 from ruff2bitbucket import main
+from ruff2bitbucket.__main__ import capture_findings
+from ruff2bitbucket.arguments import get_arguments
+from ruff2bitbucket.capturer import check_code_mistakes, check_formatting
+from ruff2bitbucket.common import CapturedLine, current_directory
+from ruff2bitbucket.credentials import UserPass, get_credentials
+from ruff2bitbucket.spool import get_spool
 
 base_url = (
     "https://localhost:12345/rest/insights/latest/projects/abc/repos/"
@@ -19,6 +32,7 @@ def _setting_default_credential(monkeypatch: pytest.MonkeyPatch) -> None:
 
 def test_main_no_credentials(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
     mocker.patch("os.environ", new={})
+    caplog.set_level(logging.INFO)  # Not the debug messages of asyncio
 
     with pytest.raises(SystemExit) as ex:
         main()
@@ -30,8 +44,9 @@ def test_main_no_credentials(mocker: MockerFixture, caplog: pytest.LogCaptureFix
 
 
 def test_main_no_valid_credentials_found(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
-    put_mock = mocker.patch("requests.put")
+    put_mock = mocker.patch("requests.Session.request")
     put_mock.return_value = mocker.Mock(status_code=401)  # UnAuthorized
+    caplog.set_level(logging.INFO)  # Not the debug messages of asyncio
 
     with pytest.raises(SystemExit) as ex:
         main()
@@ -45,9 +60,10 @@ def test_main_no_valid_credentials_found(mocker: MockerFixture, caplog: pytest.L
 def test_main_some_bitbucket_error_happened_on_statistics(
     mocker: MockerFixture, caplog: pytest.LogCaptureFixture
 ) -> None:
-    put_mock = mocker.patch("requests.put")
-    put_mock.return_value.status_code = 400
-    put_mock.return_value.json.return_value = {"dummy": 123}
+    put_mock = mocker.patch("requests.Session.request")
+    put_mock.side_effect = lambda method, *_, **__: mocker.Mock(
+        status_code=400 if method == "PUT" else 200, json=mocker.Mock(return_value={"dummy": 123})
+    )
 
     main()
 
@@ -67,18 +83,21 @@ def test_main_some_bitbucket_error_happened_on_statistics(
 def test_main_some_bitbucket_error_happened_on_annotations(
     mocker: MockerFixture, caplog: pytest.LogCaptureFixture
 ) -> None:
-    put_mock = mocker.patch("requests.put")
+    put_mock = mocker.patch("requests.Session.request")
     put_mock.return_value.status_code = 404
     put_mock.return_value.json.return_value = {"dummy": 123}
 
-    main()
+    with pytest.raises(SystemExit) as ex:
+        main()
 
+    assert ex.value.code == 1
     warning_records = [rec for rec in caplog.records if rec.levelname == "WARNING"]
     expected = [
-        f"'PUT {base_url}/annotations' reported one or more errors:",
+        f"'POST {base_url}/annotations' reported one or more errors:",
         "{",
         '    "dummy": 123',
         "}",
+        "Uploading the annotations (batch 1) failed with HTTP status 404",
     ]
 
     assert len(warning_records) == len(expected)
@@ -89,7 +108,7 @@ def test_main_some_bitbucket_error_happened_on_annotations(
 def test_main_no_errors_occurred(mocker: MockerFixture, caplog: pytest.LogCaptureFixture) -> None:
     mocker.patch("ruff2bitbucket.__main__.check_code_mistakes", return_value=[])
     mocker.patch("ruff2bitbucket.__main__.check_formatting", return_value=[])
-    put_mock = mocker.patch("requests.put")
+    put_mock = mocker.patch("requests.Session.request")
     caplog.set_level(logging.INFO)
 
     with pytest.raises(SystemExit) as ex:
@@ -105,7 +124,7 @@ def test_main_no_errors_occurred(mocker: MockerFixture, caplog: pytest.LogCaptur
 
 
 def test_main_happy_flow(mocker: MockerFixture) -> None:
-    put_mock = mocker.patch("requests.put")
+    put_mock = mocker.patch("requests.Session.request")
     put_mock.return_value = mocker.Mock(status_code=200)
 
     main()
@@ -113,6 +132,7 @@ def test_main_happy_flow(mocker: MockerFixture) -> None:
     assert put_mock.call_count == 2
 
     put_mock.assert_any_call(
+        "PUT",
         base_url,
         json={
             "result": "FAIL",
@@ -122,48 +142,282 @@ def test_main_happy_flow(mocker: MockerFixture) -> None:
             "data": [
                 {"title": "Need reformat", "type": "NUMBER", "value": 2},
                 {"title": "Issue count", "type": "NUMBER", "value": 2},
+                {"title": "Files affected", "type": "NUMBER", "value": 2},
+                {"title": "Top rules", "type": "TEXT", "value": "G004 (1), Q000 (1)"},
+                {
+                    "title": "Most affected files",
+                    "type": "TEXT",
+                    "value": "src/some_repo/filter/fltr.py (2), src/some_repo/filter/wrk.py (2)",
+                },
+                {"title": "Severities", "type": "TEXT", "value": "LOW (4)"},
             ],
         },
         auth=("USER", "PASS"),
+        timeout=(10.0, 60.0),
     )
 
-    put_mock.assert_any_call(
-        f"{base_url}/annotations",
-        json={
-            "annotations": [
-                {
-                    "reportKey": "ruff2bitbucket",
-                    "path": "src/some_repo/filter/fltr.py",
-                    "line": 337,
-                    "message": "G004 Logging statement uses f-string",
-                    "severity": "LOW",
-                    "type": "CODE_SMELL",
-                },
-                {
-                    "reportKey": "ruff2bitbucket",
-                    "path": "src/some_repo/filter/wrk.py",
-                    "line": 24,
-                    "message": "Q000 [*] Single quotes found but double quotes preferred",
-                    "severity": "LOW",
-                    "type": "CODE_SMELL",
-                },
-                {
-                    "reportKey": "ruff2bitbucket",
-                    "path": "src/some_repo/filter/fltr.py",
-                    "line": 0,
-                    "message": "Would reformat",
-                    "severity": "LOW",
-                    "type": "CODE_SMELL",
-                },
-                {
-                    "reportKey": "ruff2bitbucket",
-                    "path": "src/some_repo/filter/wrk.py",
-                    "line": 0,
-                    "message": "Would reformat",
-                    "severity": "LOW",
-                    "type": "CODE_SMELL",
-                },
-            ]
-        },
-        auth=("USER", "PASS"),
+    post_call = put_mock.call_args_list[1]
+    assert post_call.args == ("POST", f"{base_url}/annotations")
+    assert post_call.kwargs["auth"] == ("USER", "PASS")
+    assert post_call.kwargs["headers"] == {"Content-Type": "application/json"}
+    assert json.loads(b"".join(post_call.kwargs["data"])) == {
+        "annotations": [
+            {
+                "reportKey": "ruff2bitbucket",
+                "path": "src/some_repo/filter/fltr.py",
+                "line": 337,
+                "message": "G004 Logging statement uses f-string",
+                "severity": "LOW",
+                "type": "CODE_SMELL",
+            },
+            {
+                "reportKey": "ruff2bitbucket",
+                "path": "src/some_repo/filter/wrk.py",
+                "line": 24,
+                "message": "Q000 [*] Single quotes found but double quotes preferred",
+                "severity": "LOW",
+                "type": "CODE_SMELL",
+            },
+            {
+                "reportKey": "ruff2bitbucket",
+                "path": "src/some_repo/filter/fltr.py",
+                "line": 0,
+                "message": "Would reformat",
+                "severity": "LOW",
+                "type": "CODE_SMELL",
+            },
+            {
+                "reportKey": "ruff2bitbucket",
+                "path": "src/some_repo/filter/wrk.py",
+                "line": 0,
+                "message": "Would reformat",
+                "severity": "LOW",
+                "type": "CODE_SMELL",
+            },
+        ]
+    }
+
+
+def test_main_probes_multiple_credentials(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OTH_USER", "OTHER")
+    monkeypatch.setenv("OTH_PASSWORD", "SECRET")
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = lambda *_, auth, **__: mocker.Mock(status_code=401 if auth == ("USER", "PASS") else 200)
+
+    main()
+
+    calls = [(call.args[0], call.kwargs["auth"]) for call in request_mock.call_args_list]
+    assert sorted(calls[:2]) == [("GET", ("OTHER", "SECRET")), ("GET", ("USER", "PASS"))]
+    assert calls[2:] == [("PUT", ("OTHER", "SECRET")), ("POST", ("OTHER", "SECRET"))]
+    assert request_mock.call_args_list[0].args[1] == (
+        "https://localhost:12345/rest/api/latest/projects/abc/repos/repository"
+    )
+    assert get_credentials()._correct_combination == UserPass("OTHER", "SECRET")
+
+
+def test_main_probes_multiple_invalid_credentials(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setenv("OTH_USER", "OTHER")
+    monkeypatch.setenv("OTH_PASSWORD", "SECRET")
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=401)
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 1
+    assert request_mock.call_count == 2
+    assert [rec.message for rec in caplog.records if rec.levelno >= logging.WARNING] == [
+        "Cannot upload to bitbucket. No valid user/pass found."
+    ]
+
+
+def test_main_probing_a_credential_gets_a_server_error(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setenv("OTH_USER", "OTHER")
+    monkeypatch.setenv("OTH_PASSWORD", "SECRET")
+    monkeypatch.setattr(sys, "argv", ["script", "--retries", "0"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = lambda *_, auth, **__: mocker.Mock(status_code=401 if auth == ("USER", "PASS") else 503)
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 1
+    assert get_credentials()._correct_combination is None
+    assert [rec.message for rec in caplog.records if rec.levelno >= logging.WARNING] == [
+        "Trying the user/pass of 'OTHER' failed with HTTP status 503",
+        "Cannot upload to bitbucket. No valid user/pass found.",
+    ]
+
+
+def test_main_probing_the_credentials_fails(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setenv("OTH_USER", "OTHER")
+    monkeypatch.setenv("OTH_PASSWORD", "SECRET")
+    monkeypatch.setattr(sys, "argv", ["script", "--retries", "0"])
+    mocker.patch("requests.Session.request", side_effect=requests.ConnectionError("down"))
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 1
+    assert sorted(rec.message for rec in caplog.records if rec.levelname == "WARNING") == [
+        "Trying the user/pass of 'OTHER' failed: down",
+        "Trying the user/pass of 'USER' failed: down",
+    ]
+    assert caplog.records[-1].message == "Cannot upload to bitbucket. No valid user/pass found."
+
+
+def test_main_only_checks_changed_files(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--diff-base", "origin/master", "--only-changed-lines"])
+    changed_files_mock = mocker.patch(
+        "ruff2bitbucket.__main__.get_changed_files", return_value=["src/some_repo/filter/fltr.py"]
+    )
+    mocker.patch(
+        "ruff2bitbucket.__main__.get_changed_lines",
+        return_value={"src/some_repo/filter/fltr.py": [(330, 340)], "src/some_repo/filter/wrk.py": [(1, 2)]},
     )
+    check_mock = mocker.patch("ruff2bitbucket.__main__.check_code_mistakes", wraps=check_code_mistakes)
+    format_mock = mocker.patch("ruff2bitbucket.__main__.check_formatting", wraps=check_formatting)
+    fake_stream = ruff2bitbucket.capturer.stream  # Injected by conftest, but only knows about "."
+    mocker.patch("ruff2bitbucket.capturer.stream", side_effect=lambda *cmd: fake_stream(*cmd[:-1], "."))
+
+    assert [(cl.filename, cl.line) for cl in capture_findings()] == [
+        ("src/some_repo/filter/fltr.py", 337),
+        ("src/some_repo/filter/fltr.py", 0),
+        ("src/some_repo/filter/wrk.py", 0),
+    ]
+    changed_files_mock.assert_called_once_with("origin/master")
+    check_mock.assert_called_once_with(["src/some_repo/filter/fltr.py"])
+    format_mock.assert_called_once_with(["src/some_repo/filter/fltr.py"])
+
+
+def test_main_uses_the_result_cache(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--result-cache", str(tmp_path / "results.sqlite")])
+    cached_mock = mocker.patch("ruff2bitbucket.__main__.check_with_cache", return_value=[CapturedLine("a.py", 1)])
+
+    assert list(capture_findings()) == [CapturedLine("a.py", 1), CapturedLine("a.py", 1)]
+    assert [call.args[:3] for call in cached_mock.call_args_list] == [
+        (check_code_mistakes, "check", ["."]),
+        (check_formatting, "format", ["."]),
+    ]
+
+
+def test_main_batch(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, tmp_path: Path
+) -> None:
+    repositories = [tmp_path / "one", tmp_path / "two"]
+    for repository in repositories:
+        repository.mkdir()
+    (tmp_path / "targets.txt").write_text(f"# nightly\n{repositories[1]}\n")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["script", "--batch", str(repositories[0]), "unknown_commit", "--batch-file", str(tmp_path / "targets.txt")],
+    )
+
+    local_run = ruff2bitbucket.git.run
+
+    def run_per_repository(*cmd: str, check: bool) -> subprocess.CompletedProcess:
+        if cmd == ("git", "rev-parse", "HEAD"):
+            return subprocess.CompletedProcess("", 0, os.path.basename(current_directory()))
+        if cmd[:3] == ("git", "worktree", "add"):
+            raise subprocess.CalledProcessError(128, cmd)
+        return local_run(*cmd, check=check)
+
+    mocker.patch("ruff2bitbucket.git.run", new=run_per_repository)
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=200)
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 1
+    assert sorted(call.args[1] for call in request_mock.call_args_list if call.args[0] == "PUT") == [
+        base_url.replace("abcde_commit_hash_fghij", "one"),
+        base_url.replace("abcde_commit_hash_fghij", "two"),
+    ]
+    assert caplog.records[-1].message == "Cannot upload 1 of the 3 targets: unknown_commit"
+
+
+def test_main_spool_and_flush(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, tmp_path: Path
+) -> None:
+    request_mock = mocker.patch("requests.Session.request")
+    monkeypatch.setattr(os, "environ", {})  # Spooling works without credentials
+    monkeypatch.setattr(sys, "argv", ["script", "--spool-dir", str(tmp_path)])
+
+    main()
+
+    request_mock.assert_not_called()
+    assert [path.name for path in tmp_path.iterdir()] == ["abcde_commit_hash_fghij.json.gz"]
+
+    get_arguments.cache_clear()
+    get_spool.cache_clear()
+    monkeypatch.setattr(os, "environ", {"CRED_USER": "USER", "CRED_PASSWORD": "PASS"})
+    monkeypatch.setattr(sys, "argv", ["script", "--spool-dir", str(tmp_path), "--flush"])
+    request_mock.return_value = mocker.Mock(status_code=503)
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 1
+    assert caplog.records[-1].message == "Cannot upload 1 of the 1 spooled commits; they stay in the spool."
+    assert len(list(tmp_path.iterdir())) == 1
+
+    request_mock.reset_mock()
+    request_mock.return_value = mocker.Mock(status_code=200)
+
+    main()
+
+    assert [call.args[:2] for call in request_mock.call_args_list] == [
+        ("PUT", base_url),
+        ("POST", f"{base_url}/annotations"),
+    ]
+    assert request_mock.call_args_list[0].kwargs["json"]["data"][0] == {
+        "title": "Need reformat",
+        "type": "NUMBER",
+        "value": 2,
+    }
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_main_flush_needs_a_spool(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--flush"])
+
+    with pytest.raises(SystemExit) as ex:
+        main()
+
+    assert ex.value.code == 2
+
+
+def test_main_caps_the_annotations(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--max-annotations", "1", "--severity", "Q000=HIGH"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=200)
+
+    main()
+
+    report_call, annotations_call = request_mock.call_args_list
+    report, annotations = report_call.kwargs["json"], json.loads(b"".join(annotations_call.kwargs["data"]))
+    assert report["data"][1] == {"title": "Issue count", "type": "NUMBER", "value": 2}
+    assert [(annotation["path"], annotation["severity"]) for annotation in annotations["annotations"]] == [
+        ("src/some_repo/filter/wrk.py", "HIGH")
+    ]
+
+
+def test_main_imports_the_http_stack_lazily() -> None:
+    lazy_modules = {"requests", "asyncio", "sqlite3", "importlib.metadata", "cProfile", "pstats"}
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, ruff2bitbucket.__main__; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    assert "ruff2bitbucket.__main__" in imported
+    assert not lazy_modules & set(imported)
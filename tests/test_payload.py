@@ -0,0 +1,50 @@
+import gzip
+import json
+
+import pytest
+
+from ruff2bitbucket.payload import JsonStream, truncate
+
+
+@pytest.mark.parametrize(
+    ("text", "max_bytes", "expected"),
+    [
+        ("short", 10, "short"),
+        ("a" * 20, 10, "a" * 7 + "…"),
+        ("é" * 10, 10, "é" * 3 + "…"),  # 2 bytes per character: the last one would be cut in half
+        ("a" * 20, 0, "a" * 20),
+        ("abcdefgh", 2, "ab"),
+        ("abcdefgh", 3, "abc"),
+        ("abcdefgh", 4, "a…"),
+        ("é" * 4, 3, "é"),
+    ],
+)
+def test_truncate(text: str, max_bytes: int, expected: str) -> None:
+    assert truncate(text, max_bytes) == expected
+
+
+def test_json_stream_in_chunks() -> None:
+    items = [{"line": idx, "message": "x" * 1_000} for idx in range(200)]
+    stream = JsonStream("annotations", lambda: iter(items))
+
+    chunks = list(stream)
+
+    assert len(chunks) == 4  # Of about 64 KiB
+    assert json.loads(b"".join(chunks)) == {"annotations": items}
+    assert stream.size == sum(map(len, chunks))
+    assert list(stream) == chunks  # Sent again when the request is retried
+
+
+def test_json_stream_compressed() -> None:
+    stream = JsonStream("annotations", lambda: ({"line": idx} for idx in range(1_000)), compress=True)
+
+    body = b"".join(stream)
+
+    assert json.loads(gzip.decompress(body)) == {"annotations": [{"line": idx} for idx in range(1_000)]}
+    assert stream.headers == {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    assert stream.size == len(body) < len(json.dumps({"annotations": [{"line": idx} for idx in range(1_000)]}))
+    assert json.loads(b"".join(stream.uncompressed())) == json.loads(gzip.decompress(body))
+
+
+def test_json_stream_empty() -> None:
+    assert json.loads(b"".join(JsonStream("annotations", list))) == {"annotations": []}
@@ -0,0 +1,66 @@
+import sys
+
+import pytest
+
+from ruff2bitbucket.arguments import get_arguments
+from ruff2bitbucket.bitbucket import annotation_severity, annotation_type
+from ruff2bitbucket.common import CapturedLine
+from ruff2bitbucket.severity import RuleTable, default_rules, get_rule_table, parse_rules
+
+
+@pytest.mark.parametrize(
+    ("code", "expected"),
+    [
+        ("E501", ("LOW", "CODE_SMELL")),
+        ("E902", ("HIGH", "BUG")),
+        ("F401", ("LOW", "CODE_SMELL")),
+        ("F821", ("HIGH", "BUG")),
+        ("B006", ("MEDIUM", "BUG")),
+        ("S101", ("HIGH", "VULNERABILITY")),
+        ("SIM102", ("LOW", "CODE_SMELL")),  # Not bandit
+        ("PLE0101", ("HIGH", "BUG")),
+        ("RUF006", ("MEDIUM", "BUG")),
+        ("RUF005", ("LOW", "CODE_SMELL")),
+        ("C901", ("MEDIUM", "CODE_SMELL")),
+        ("C401", ("LOW", "CODE_SMELL")),
+    ],
+)
+def test_lookup(code: str, expected: tuple) -> None:
+    assert RuleTable(default_rules).lookup(code) == expected
+
+
+def test_classify_without_code() -> None:
+    table = RuleTable({})
+
+    assert table.classify(CapturedLine("a.py", 1, description="SyntaxError: Expected ')'")) == ("HIGH", "BUG")
+    assert table.classify(CapturedLine("a.py", description="Would reformat")) == ("LOW", "CODE_SMELL")
+
+
+def test_invalid_rules() -> None:
+    with pytest.raises(ValueError, match="Invalid severity/type for 'S'"):
+        RuleTable({"S": ("CRITICAL", "BUG")})
+
+    with pytest.raises(ValueError, match="Expected RULE=SEVERITY"):
+        parse_rules(["S101"])
+
+
+def test_rules_from_the_arguments(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--severity", "E501=medium", "--severity", "S101=LOW:CODE_SMELL"])
+
+    assert annotation_severity(CapturedLine("a.py", code="E501")) == "MEDIUM"
+    assert annotation_type(CapturedLine("a.py", code="E501")) == "CODE_SMELL"
+    assert get_rule_table().lookup("S101") == ("LOW", "CODE_SMELL")
+    assert get_rule_table().lookup("S102") == ("HIGH", "VULNERABILITY")
+
+
+@pytest.mark.parametrize("option", ["S=CRITICAL", "S", "S=HIGH:FEATURE"])
+def test_invalid_rules_in_the_arguments(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture, option: str
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--severity", option])
+
+    with pytest.raises(SystemExit) as ex:
+        get_arguments()
+
+    assert ex.value.code == 2
+    assert "error: " in capsys.readouterr().err
@@ -0,0 +1,58 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+from ruff2bitbucket.aggregation import FindingStatistics
+from ruff2bitbucket.arguments import get_arguments
+from ruff2bitbucket.bitbucket import get_repo_info
+from ruff2bitbucket.common import CapturedLine
+from ruff2bitbucket.spool import Spool, get_spool
+
+
+def test_spool_round_trip(tmp_path: Path) -> None:
+    spool = Spool(str(tmp_path / "spool"))
+    repo_info = get_repo_info()
+    captured_lines = [CapturedLine("a.py", 1, 2, "F401 [*] unused", "F401", 1, 5, True), CapturedLine("b.py")]
+    statistics = FindingStatistics()
+    list(statistics.collect([*captured_lines, CapturedLine("c.py", 3, code="E501")]))
+
+    path = spool.put(repo_info, statistics, captured_lines)
+
+    assert path == str(tmp_path / "spool" / "abcde_commit_hash_fghij.json.gz")
+    assert spool.entries() == [path]
+
+    restored, restored_statistics, restored_lines = spool.load(path)
+    assert restored_lines == captured_lines
+    assert restored_statistics == statistics
+    assert restored.commit_id == repo_info.commit_id
+    assert restored.report_endpoint == repo_info.report_endpoint
+    assert restored.commit_url == repo_info.commit_url
+
+    spool.put(repo_info, statistics, captured_lines[:1])  # Same commit: replaces the earlier findings
+    assert spool.entries() == [path]
+    assert spool.load(path)[2] == captured_lines[:1]
+
+    spool.remove(path)
+    spool.remove(path)
+    assert spool.entries() == []
+
+
+def test_spool_unknown_version(tmp_path: Path) -> None:
+    path = tmp_path / "abc.json.gz"
+    with gzip.open(path, "wt") as fp:
+        json.dump({"version": 2}, fp)
+
+    with pytest.raises(ValueError, match="Unknown version"):
+        Spool(str(tmp_path)).load(str(path))
+
+
+def test_get_spool(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    assert get_spool() is None
+
+    get_spool.cache_clear()
+    monkeypatch.setattr(sys, "argv", ["script", "--spool-dir", str(tmp_path)])
+    get_arguments.cache_clear()
+    assert get_spool() == Spool(str(tmp_path))
@@ -0,0 +1,133 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket.transport import CircuitOpenError, RetryPolicy, get_session, request, retry_budget
+
+
+def test_session_is_shared() -> None:
+    assert get_session() is get_session()
+
+
+def test_session_pool_size(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--pool-size", "3"])
+
+    adapter = get_session().get_adapter("https://localhost:12345")
+    assert adapter._pool_maxsize == 3
+    assert adapter is get_session().get_adapter("http://localhost:12345")
+
+
+def test_request_uses_timeouts(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--connect-timeout", "1.5", "--read-timeout", "7"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value.status_code = 200
+
+    assert request("PUT", "https://localhost", json={}) is request_mock.return_value
+    request_mock.assert_called_once_with("PUT", "https://localhost", timeout=(1.5, 7.0), json={})
+
+
+def test_request_retries_when_overloaded(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retry-backoff", "1"])
+    sleep_mock = mocker.patch("ruff2bitbucket.transport.sleep")
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = [
+        mocker.Mock(status_code=429, headers={"Retry-After": "7"}),
+        requests.Timeout("too slow"),
+        mocker.Mock(status_code=502, headers={}),
+        mocker.Mock(status_code=200),
+    ]
+
+    assert request("PUT", "https://localhost").status_code == 200
+
+    assert request_mock.call_count == 4
+    waits = [call.args[0] for call in sleep_mock.call_args_list]
+    assert waits[0] == 7.0
+    assert 0 <= waits[1] <= 2.0
+    assert 0 <= waits[2] <= 4.0
+
+
+@pytest.mark.parametrize("status", [200, 400, 401, 404, 501])
+def test_request_does_not_retry(status: int, mocker: MockerFixture) -> None:
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=status)
+
+    assert request("GET", "https://localhost").status_code == status
+    assert request_mock.call_count == 1
+
+
+def test_request_does_not_resend_a_post_that_timed_out(mocker: MockerFixture) -> None:
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = [requests.ConnectTimeout("no connection"), requests.ReadTimeout("no answer")]
+
+    with pytest.raises(requests.ReadTimeout, match="no answer"):
+        request("POST", "https://localhost")
+    assert request_mock.call_count == 2  # Never connecting is safe to retry, not getting an answer isn't
+
+
+def test_request_gives_up(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retries", "2"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = requests.ConnectionError("refused")
+
+    with pytest.raises(requests.ConnectionError, match="refused"):
+        request("GET", "https://localhost")
+    assert request_mock.call_count == 3
+
+
+def test_request_shares_the_endpoint_budget(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retry-budget", "3", "--circuit-breaker", "100"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=503, headers={})
+
+    assert request("POST", "https://localhost/a").status_code == 503
+    assert request("POST", "https://localhost/a").status_code == 503
+    assert request_mock.call_count == 5  # 2 calls + 3 retries
+
+    assert request("POST", "https://localhost/b").status_code == 503
+    assert request_mock.call_count == 9  # Another endpoint has its own budget
+
+
+def test_request_budget_per_upload(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retry-budget", "2", "--circuit-breaker", "100"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=503, headers={})
+
+    for _ in range(2):
+        with retry_budget():
+            assert request("GET", "https://localhost/a").status_code == 503
+
+    assert request_mock.call_count == 6  # Every upload gets its 2 retries
+
+
+def test_circuit_breaker(monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retries", "0", "--circuit-breaker", "2"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.side_effect = requests.ConnectionError("refused")
+    monotonic_mock = mocker.patch("time.monotonic", return_value=100.0)
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError, match="refused"):
+            request("GET", "https://localhost")
+
+    with pytest.raises(CircuitOpenError):
+        request("GET", "https://localhost")
+    assert request_mock.call_count == 2
+
+    monotonic_mock.return_value = 130.0  # After the cooldown one call is let through again
+    request_mock.side_effect = None
+    request_mock.return_value = mocker.Mock(status_code=200)
+    assert request("GET", "https://localhost").status_code == 200
+    assert request("GET", "https://localhost").status_code == 200
+
+
+def test_retry_after_as_date() -> None:
+    policy = RetryPolicy(retries=3, backoff=0.5, max_wait=60.0, endpoint_budget=10, breaker_threshold=5)
+    when = datetime.now(timezone.utc) + timedelta(seconds=20)
+
+    assert 15 < policy.delay(0, format_datetime(when, usegmt=True)) <= 20
+    assert policy.delay(0, "120") == 60.0  # Capped
+    assert policy.delay(0, "garbage") <= 0.5
@@ -0,0 +1,250 @@
+import asyncio
+import gzip
+import json
+import logging
+import sys
+from typing import Iterable, Optional
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+from ruff2bitbucket.aggregation import FindingStatistics
+from ruff2bitbucket.bitbucket import get_repo_info
+from ruff2bitbucket.common import CapturedLine
+from ruff2bitbucket.uploader import annotation, compare_annotations, upload, upload_code_insights
+
+base_url = (
+    "https://localhost:12345/rest/insights/latest/projects/abc/repos/"
+    "repository/commits/abcde_commit_hash_fghij/reports/ruff2bitbucket"
+)
+
+
+def sent(body: Iterable[bytes]) -> dict:
+    """The json of a streamed request body."""
+    data = b"".join(body)
+    return json.loads(gzip.decompress(data) if data.startswith(b"\x1f\x8b") else data)
+
+
+@pytest.fixture(autouse=True)
+def _setting_default_credential(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("CRED_USER", "USER")
+    monkeypatch.setenv("CRED_PASSWORD", "PASS")
+
+
+def test_upload_code_insights_in_batches(mocker: MockerFixture) -> None:
+    post_mock = mocker.patch("requests.Session.request")
+    post_mock.return_value = mocker.Mock(status_code=200)
+
+    asyncio.run(
+        upload_code_insights(f"{base_url}/annotations", [CapturedLine(f"file{idx}.py", idx) for idx in range(2_500)])
+    )
+
+    batches = [sent(call.kwargs["data"])["annotations"] for call in post_mock.call_args_list]
+    assert sorted(len(batch) for batch in batches) == [500, 1_000, 1_000]
+    assert sorted(annotation["line"] for batch in batches for annotation in batch) == list(range(2_500))
+
+
+def test_upload_code_insights_retries_a_failed_batch(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(
+        sys, "argv", ["script", "--annotation-batch-size", "2", "--upload-concurrency", "1", "--retry-backoff", "0"]
+    )
+    caplog.set_level(logging.INFO)
+    post_mock = mocker.patch("requests.Session.request")
+    post_mock.side_effect = [
+        mocker.Mock(status_code=200),
+        mocker.Mock(status_code=503),
+        requests.ConnectionError("connection reset"),
+        mocker.Mock(status_code=200),
+    ]
+
+    asyncio.run(upload_code_insights(f"{base_url}/annotations", [CapturedLine("file.py", idx) for idx in range(4)]))
+
+    assert post_mock.call_count == 4
+    assert [sent(call.kwargs["data"])["annotations"][0]["line"] for call in post_mock.call_args_list] == [0, 2, 2, 2]
+    assert [rec.message for rec in caplog.records if rec.levelname == "INFO"] == [
+        f"'POST {base_url}/annotations' failed (HTTP status 503), retrying in 0.0 seconds.",
+        f"'POST {base_url}/annotations' failed (connection reset), retrying in 0.0 seconds.",
+    ]
+    assert not [rec for rec in caplog.records if rec.levelname == "WARNING"]
+
+
+def test_upload_code_insights_gives_up_on_a_batch(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--annotation-batch-size", "2", "--retries", "1"])
+    post_mock = mocker.patch("requests.Session.request")
+    post_mock.side_effect = lambda *_, data, **__: mocker.Mock(
+        status_code=500 if sent(data)["annotations"][0]["line"] == 2 else 200
+    )
+
+    with pytest.raises(SystemExit) as ex:
+        asyncio.run(upload_code_insights(f"{base_url}/annotations", [CapturedLine("file.py", idx) for idx in range(6)]))
+
+    assert ex.value.code == 1
+    assert post_mock.call_count == 4
+    assert [rec.message for rec in caplog.records if rec.levelname in ("WARNING", "ERROR")] == [
+        "Uploading the annotations (batch 2) failed with HTTP status 500",
+        "Cannot upload 1 of the 3 annotation batches to bitbucket.",
+    ]
+
+
+@pytest.mark.parametrize("status_code", [400, 403, 404])
+def test_upload_code_insights_a_batch_is_refused(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, status_code: int
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--annotation-batch-size", "2"])
+    post_mock = mocker.patch("requests.Session.request")
+    post_mock.side_effect = lambda *_, data, **__: mocker.Mock(
+        status_code=status_code if sent(data)["annotations"][0]["line"] == 2 else 200,
+        json=mocker.Mock(return_value={"errors": []}),
+    )
+
+    with pytest.raises(SystemExit) as ex:
+        asyncio.run(upload_code_insights(f"{base_url}/annotations", [CapturedLine("file.py", idx) for idx in range(4)]))
+
+    assert ex.value.code == 1
+    assert post_mock.call_count == 2  # Not worth retrying
+    assert [rec.message for rec in caplog.records if rec.levelname in ("WARNING", "ERROR")][-2:] == [
+        f"Uploading the annotations (batch 2) failed with HTTP status {status_code}",
+        "Cannot upload 1 of the 2 annotation batches to bitbucket.",
+    ]
+
+
+def test_upload_gets_a_retry_budget_every_time(mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retry-budget", "1", "--circuit-breaker", "100"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=503, headers={})
+    statistics = FindingStatistics()
+    list(statistics.collect([CapturedLine("file.py", 1)]))
+
+    for _ in range(2):  # Like the jobs of a daemon
+        request_mock.reset_mock()
+        with pytest.raises(SystemExit):
+            asyncio.run(upload(get_repo_info(), statistics, [CapturedLine("file.py", 1)]))
+        assert request_mock.call_count == 2
+
+
+def test_upload_creates_the_report_before_the_annotations(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--annotation-batch-size", "1"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=200)
+    captured_lines = [CapturedLine("file.py", idx) for idx in range(3)]
+    statistics = FindingStatistics()
+    list(statistics.collect(captured_lines))
+
+    asyncio.run(upload(get_repo_info(), statistics, captured_lines))
+
+    assert [(call.args[0], call.args[1]) for call in request_mock.call_args_list] == [
+        ("PUT", base_url),
+        ("POST", f"{base_url}/annotations"),
+        ("POST", f"{base_url}/annotations"),
+        ("POST", f"{base_url}/annotations"),
+    ]
+
+
+def test_upload_fails_when_the_report_cannot_be_stored(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--retries", "0"])
+    request_mock = mocker.patch("requests.Session.request")
+    request_mock.return_value = mocker.Mock(status_code=503)
+    captured_lines = [CapturedLine("file.py", 1)]
+    statistics = FindingStatistics()
+    list(statistics.collect(captured_lines))
+
+    with pytest.raises(SystemExit) as ex:
+        asyncio.run(upload(get_repo_info(), statistics, captured_lines))
+
+    assert ex.value.code == 1
+    assert request_mock.call_count == 1
+    assert caplog.records[-1].message == "Cannot upload the report to bitbucket: HTTP status 503"
+
+
+def test_compare_annotations() -> None:
+    kept = CapturedLine("a.py", 1, description="E1")
+    changed = CapturedLine("a.py", 2, code="S101")
+    added = CapturedLine("b.py", 3)
+    existing = [
+        annotation(kept, with_id=True),
+        {**annotation(changed, with_id=True), "severity": "LOW"},  # Before --severity S=HIGH
+        annotation(CapturedLine("a.py", 5), with_id=True),  # Fixed in the meantime
+    ]
+
+    additions, stale = compare_annotations(existing, [kept, changed, added, added])
+
+    assert additions == [changed, added]
+    assert stale == [existing[1]["externalId"], existing[2]["externalId"]]
+    assert compare_annotations([annotation(kept)], [kept]) == ([kept], None)  # Uploaded without ids
+
+
+def test_upload_reconciles_with_what_is_stored(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--reconcile"])
+    caplog.set_level(logging.INFO)
+    kept, added = CapturedLine("a.py", 1, description="E1"), CapturedLine("b.py", 2, description="E2")
+    stale = annotation(CapturedLine("a.py", 5), with_id=True)
+    stored = {"report": None, "annotations": [annotation(kept, with_id=True), stale]}
+
+    def bitbucket(method: str, url: str, json: Optional[dict] = None, data: object = None, **_: object) -> object:
+        path, _, query = url.partition("?")
+        if method == "PUT":
+            stored["report"] = json
+        elif method == "POST":
+            stored["annotations"] += sent(data)["annotations"]
+        elif method == "DELETE":
+            ids = parse_qs(query)["externalId"]
+            stored["annotations"] = [item for item in stored["annotations"] if item["externalId"] not in ids]
+        content = {"annotations": stored["annotations"]} if path.endswith("/annotations") else stored["report"]
+        return mocker.Mock(status_code=200 if content else 404, json=mocker.Mock(return_value=content))
+
+    request_mock = mocker.patch("requests.Session.request", side_effect=bitbucket)
+    statistics = FindingStatistics()
+    list(statistics.collect([kept, added]))
+
+    asyncio.run(upload(get_repo_info(), statistics, [kept, added]))
+
+    assert [call.args[:2] for call in request_mock.call_args_list] == [
+        ("GET", base_url),
+        ("PUT", base_url),
+        ("GET", f"{base_url}/annotations"),
+        ("DELETE", f"{base_url}/annotations?externalId={stale['externalId']}"),
+        ("POST", f"{base_url}/annotations"),
+    ]
+    assert sent(request_mock.call_args_list[-1].kwargs["data"]) == {"annotations": [annotation(added, with_id=True)]}
+    assert stored["annotations"] == [annotation(kept, with_id=True), annotation(added, with_id=True)]
+    assert "1 annotations added, 1 removed and 1 unchanged." in caplog.messages
+
+    request_mock.reset_mock()
+    asyncio.run(upload(get_repo_info(), statistics, [kept, added]))  # Nothing changed
+
+    assert [call.args[:2] for call in request_mock.call_args_list] == [
+        ("GET", base_url),
+        ("GET", f"{base_url}/annotations"),
+    ]
+
+
+@pytest.mark.parametrize("refused", [415, 400])  # 400: the gzip was taken for (bad) json
+def test_upload_code_insights_compressed(
+    mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture, refused: int
+) -> None:
+    monkeypatch.setattr(sys, "argv", ["script", "--compress", "--max-message-bytes", "10"])
+    caplog.set_level(logging.INFO)
+    post_mock = mocker.patch("requests.Session.request")
+    post_mock.side_effect = lambda *_, headers, **__: mocker.Mock(
+        status_code=refused if "Content-Encoding" in headers else 200
+    )
+
+    asyncio.run(upload_code_insights(f"{base_url}/annotations", [CapturedLine("file.py", 1, description="E501 " * 5)]))
+    asyncio.run(upload_code_insights(f"{base_url}/annotations", [CapturedLine("file.py", 2)]))
+
+    assert [call.kwargs["headers"].get("Content-Encoding") for call in post_mock.call_args_list] == ["gzip", None, None]
+    assert sent(post_mock.call_args_list[0].kwargs["data"]) == sent(post_mock.call_args_list[1].kwargs["data"])
+    assert sent(post_mock.call_args_list[0].kwargs["data"])["annotations"][0]["message"] == "E501 E5…"
+    assert caplog.messages == ["BitBucket doesn't accept compressed requests, they are sent uncompressed."]